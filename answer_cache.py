@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+from ingestion import MANIFEST_PATH
+
+
+ANSWER_CACHE_PATH = "data/cache/answers.sqlite3"
+SIMILARITY_THRESHOLD = 0.95  # cosine similarity above which two first-turn questions count as the same
+ANSWER_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+def current_index_version(path: str = MANIFEST_PATH) -> Optional[str]:
+    """Returns the index version recorded by preprocessing.py, which changes whenever budgetinfo is re-indexed."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("index_version")
+    except (OSError, ValueError):
+        return None
+
+
+class AnswerCache:
+    """Serves stored answers to first-turn questions that are semantically the same as one answered before."""
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, threshold: float = SIMILARITY_THRESHOLD, ttl_seconds: float = ANSWER_TTL_SECONDS):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._index_version = None
+        self._manifest_mtime = None
+        self._ids = []
+        self._answers = []
+        self._created = np.empty(0)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, question TEXT NOT NULL, embedding BLOB NOT NULL, "
+                "answer TEXT NOT NULL, created_at REAL NOT NULL, index_version TEXT)"
+            )
+        return self._conn
+
+    def _refresh(self):
+        """Reloads entries when first used or when the collection has been re-indexed since the last load."""
+        try:
+            mtime = os.path.getmtime(MANIFEST_PATH)
+        except OSError:
+            mtime = None
+        if self._manifest_mtime == mtime and self._conn is not None:
+            return
+        self._manifest_mtime = mtime
+        self._index_version = current_index_version()
+
+        conn = self._connection()
+        # Answers generated against an older index may cite chunks that changed, so drop them
+        conn.execute("DELETE FROM answers WHERE index_version IS NOT ?", (self._index_version,))
+        conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        conn.commit()
+
+        rows = conn.execute("SELECT id, embedding, answer, created_at FROM answers").fetchall()
+        self._ids = [row[0] for row in rows]
+        self._answers = [row[2] for row in rows]
+        self._created = np.array([row[3] for row in rows], dtype=np.float64)
+        self._matrix = np.array([np.frombuffer(row[1], dtype=np.float32) for row in rows], dtype=np.float32)
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Returns the stored answer for the most similar cached question, or None if nothing is close enough."""
+        with self.lock:
+            self._refresh()
+            if len(self._ids):
+                similarities = self._matrix @ self._normalize(embedding)
+                similarities[self._created < time.time() - self.ttl_seconds] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    return self._answers[best]
+            self.misses += 1
+            return None
+
+    def store(self, question: str, embedding: List[float], answer: str):
+        """Stores the answer to a first-turn question."""
+        with self.lock:
+            self._refresh()
+            vector = self._normalize(embedding)
+            now = time.time()
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO answers (question, embedding, answer, created_at, index_version) VALUES (?, ?, ?, ?, ?)",
+                (question, vector.tobytes(), answer, now, self._index_version),
+            )
+            conn.commit()
+            self._ids.append(cursor.lastrowid)
+            self._answers.append(answer)
+            self._created = np.append(self._created, now)
+            self._matrix = vector[np.newaxis, :] if not self._matrix.size else np.vstack([self._matrix, vector])
+
+    def stats(self) -> Dict:
+        """Returns hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._ids),
+        }
@@ -1,17 +1,22 @@
+import time
+import uuid
 import streamlit as st
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
-import chromadb
 from typing import List
 import re
-import time
-from functions import create_embedding, count_tokens, sanitize_text, save_chat_history, classify_message
+from functions import create_embedding, sanitize_text, StreamSanitizer, model as classification_model
+from token_estimator import estimate_tokens
+from postprocessing import worker as postprocessing_worker
+from context_packer import pack_context
+from conversation_memory import ConversationMemory, contents_text
+from bm25_index import hybrid_query
+from resources import get_collection, get_bm25_index, get_answer_cache, get_generative_model
 from datetime import datetime
 
 
-# Load environment variables
-load_dotenv(dotenv_path="config/.env")
+# Log how long setup takes on each rerun (Streamlit re-runs this script on every interaction)
+DEBUG_TIMINGS = False
+rerun_start = time.perf_counter()
 
 st.title("KiasuKaki")
 
@@ -78,12 +83,37 @@ else:
 #             st.sidebar.warning("Please provide some feedback before submitting.")
 
 
-# Initialize ChromaDB with path to local database
-chroma_client = chromadb.PersistentClient(path="chroma_db")
-collection = chroma_client.get_collection("budgetinfo")
+# Shared resources, created once per process and reused across reruns and sessions
+collection = get_collection()
+bm25_index = get_bm25_index()  # None until preprocessing.py has built it, vector search is used alone then
+answer_cache = get_answer_cache()  # answers to first-turn questions
+
+# Stream responses token by token instead of waiting for the full answer
+STREAM_RESPONSES = True
+
+# Chatbot instructions, sent as the system instruction with every request
+SYSTEM_INSTRUCTION = """You are a helpful and informative assistant chatbot designed to provide citizens with information about government schemes. Your goal is to provide clear, accurate, and well-formatted information based on the documents provided and the previous conversation history. You will add a formatted feedback line to the end of your responses, *unless* the user has asked a question about providing feedback.
 
-# Configure Gemini API using key from .env
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+Instructions:
+1. Base your response ONLY on the provided context from the Budget 2024 documents and the previous conversation. Avoid introducing external knowledge or assumptions.
+2. Provide a clear and concise answer that is easy to understand for the average citizen. Do not include italicized words, bold text, or any special formatting unless explicitly required by the user. The output text should contain only standard text characters.
+3. If the user's question is *only* a simple greeting (e.g., "hi", "hello", "good morning"), acknowledge the greeting politely, and state that you are a chatbot designed to provide information about government schemes, and then ask how you can assist them. Do *not* provide a list of schemes. If the user's question is not a simple greeting, but is vague or ambiguous, or if the question is related to the topic but the context is insufficient to answer it directly, **ask a specific clarifying question** to help you better understand the user's needs, *before* stating that you do not have enough information to answer specifically from the Budget 2024 documents. Do not state "I do not have enough information" without first making an attempt to understand the user's needs. If you are able to provide some relevant context even if you can not fully answer the question, provide that relevant context.
+4. When applicable, include specific details like dates, amounts, or specific scheme names from the context to be most accurate. Ensure that numerical ranges are formatted correctly with spaces (e.g., "200 to 400"), and there is a space after any number and before any word. Remove any extraneous text, such as the names of schemes or documents, that may be next to each requirement if they do not add clarity.
+5. Avoid carrying over formatting from source documents that may include italics, bold text, or other stylistic choices unless they are necessary for clarity.
+6. If the provided context has multiple options that may answer the question, provide all options, and explain all of them clearly.
+7. If the information from the context may be confusing or has multiple meanings, explain each option clearly, without making a specific assumption.
+8. Do not generate or include information not found in the provided document.
+9. Prioritize clarity and accuracy in your responses. If there are discrepancies or outdated information from blog posts or less reliable sources, prioritize information aligned with official government documents when available.
+10. Structure your response with clear newlines to separate sentences and paragraphs for readability.
+11. Use bullet points for lists to make information easy to digest.
+12. Use headers where necessary to organize information effectively and enhance reader understanding.
+13. Sanitize the output to ensure that text is clean and consistent, avoiding any carryover of special formatting or symbols from source documents, and that text is spaced correctly with numbers.
+14. The response should only have standard text characters, no html characters or special characters.
+15. If you do not have enough information to provide an answer specifically from the Budget 2024 documents, ask a clarifying question so that the user can be more specific to give you enough information to answer their question.
+16. If the user asks where they can give feedback, tell them that they can give feedback directly to the chatbot, and they can also visit official government websites or use official government feedback channels.
+17. If the user provides feedback, acknowledge and thank them for it, using an elegant tone. If the feedback also includes a question, respond to the question. Use the chat history to determine if the user is providing feedback.
+18. *Unless* the user has asked a question about providing feedback, add a new line, and then add the following message as a separate line at the end of your response: '\n\n---\n**If you have any feedback, you may provide it directly to this bot, visit official government websites, or use government feedback channels.**'
+"""
 
 # Generation config
 generation_config = {
@@ -94,15 +124,22 @@ generation_config = {
     "response_mime_type": "text/plain",
 }
 
-# Initialize model and chat session in session state
+summary_generation_config = {
+    "temperature": 0.2,
+    "max_output_tokens": 1024,
+    "response_mime_type": "text/plain",
+}
+
+# Model used to fold older turns into the conversation summary
+summary_model = get_generative_model(summary_generation_config)
+
+# Initialize model and conversation memory in session state
 if "model" not in st.session_state:
-    st.session_state.model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash-exp",
-        generation_config=generation_config,
-    )
+    st.session_state.model = get_generative_model(generation_config, system_instruction=SYSTEM_INSTRUCTION)
 
-if "chat_session" not in st.session_state:
-    st.session_state.chat_session = st.session_state.model.start_chat(history=[])
+# Conversation memory replaces a stateful chat session, so history is sent once per request
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -113,9 +150,11 @@ if "total_input_tokens" not in st.session_state:
 if "total_output_tokens" not in st.session_state:
   st.session_state.total_output_tokens = 0
 
-# Set a flag for whether it's a new session
-if "new_session" not in st.session_state:
-    st.session_state.new_session = True
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # groups this conversation's turns in the chat log
+
+if DEBUG_TIMINGS:
+    print(f"Rerun setup took {(time.perf_counter() - rerun_start) * 1000:.0f} ms")
 
 # Display chat messages
 for message in st.session_state.messages:
@@ -133,115 +172,136 @@ if prompt := st.chat_input("Type something"):
         # Create embedding for the query
         query_embedding = create_embedding(prompt)
         
-        # Query ChromaDB using the embedding
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=60,  # Get top 5 most relevant documents
-            include=["documents","metadatas"]
-        )
-        
-        # Prepare context from retrieved documents
-        context_docs = results['documents'][0]  # List of retrieved document texts
-        context_metadata = results['metadatas'][0]  # list of retrieved metadatas
-
-        # Format the chat history to include in prompt
-        chat_history = ""
-        for message in st.session_state.messages[:-1]:
-            if message["role"] == "user":
-                chat_history += f"User: {message['content']}\n"
-            elif message["role"] == "assistant":
-               chat_history += f"Assistant: {message['content']}\n"
-        
-        # Create enhanced prompt with context
-        enhanced_prompt = f"""You are a helpful and informative assistant chatbot designed to provide citizens with information about government schemes. Your goal is to provide clear, accurate, and well-formatted information based on the documents provided and the previous conversation history. You will add a formatted feedback line to the end of your responses, *unless* the user has asked a question about providing feedback.
+        # Serve repeated first-turn questions from the answer cache
+        is_first_turn = len(st.session_state.messages) == 1
+        cached_answer = answer_cache.lookup(query_embedding) if is_first_turn else None
+        if is_first_turn:
+            cache_stats = answer_cache.stats()
+            print(f"Answer cache {'hit' if cached_answer else 'miss'} (hit rate {cache_stats['hit_rate']:.0%} over {cache_stats['hits'] + cache_stats['misses']} lookups)")
 
-        Context from Budget 2024 documents about government schemes:
-        {' '.join(context_docs)}
+        if cached_answer is not None:
+            sanitized_response_text = cached_answer
+            with st.chat_message("assistant"):
+                st.markdown(sanitized_response_text)
+            st.session_state.memory.add_turn(prompt, f"User's question: {prompt}", sanitized_response_text, summary_model=summary_model)
+        else:
+            # Retrieve chunks by fusing vector search in ChromaDB with the local BM25 index
+            results = hybrid_query(collection, bm25_index, prompt, query_embedding, n_results=20)
+            print(f"Retrieval: vector {results['timings']['vector_seconds'] * 1000:.0f} ms, "
+                  f"BM25 {results['timings']['lexical_seconds'] * 1000:.0f} ms")
         
-        Previous Conversation:
-        {chat_history}
-
-        User's question: {prompt}
-
-        Instructions:
-        1. Base your response ONLY on the provided context from the Budget 2024 documents and the previous conversation. Avoid introducing external knowledge or assumptions.
-        2. Provide a clear and concise answer that is easy to understand for the average citizen. Do not include italicized words, bold text, or any special formatting unless explicitly required by the user. The output text should contain only standard text characters.
-        3. If the user's question is *only* a simple greeting (e.g., "hi", "hello", "good morning"), acknowledge the greeting politely, and state that you are a chatbot designed to provide information about government schemes, and then ask how you can assist them. Do *not* provide a list of schemes. If the user's question is not a simple greeting, but is vague or ambiguous, or if the question is related to the topic but the context is insufficient to answer it directly, **ask a specific clarifying question** to help you better understand the user's needs, *before* stating that you do not have enough information to answer specifically from the Budget 2024 documents. Do not state "I do not have enough information" without first making an attempt to understand the user's needs. If you are able to provide some relevant context even if you can not fully answer the question, provide that relevant context.
-        4. When applicable, include specific details like dates, amounts, or specific scheme names from the context to be most accurate. Ensure that numerical ranges are formatted correctly with spaces (e.g., "200 to 400"), and there is a space after any number and before any word. Remove any extraneous text, such as the names of schemes or documents, that may be next to each requirement if they do not add clarity.
-        5. Avoid carrying over formatting from source documents that may include italics, bold text, or other stylistic choices unless they are necessary for clarity.
-        6. If the provided context has multiple options that may answer the question, provide all options, and explain all of them clearly.
-        7. If the information from the context may be confusing or has multiple meanings, explain each option clearly, without making a specific assumption.
-        8. Do not generate or include information not found in the provided document.
-        9. Prioritize clarity and accuracy in your responses. If there are discrepancies or outdated information from blog posts or less reliable sources, prioritize information aligned with official government documents when available.
-        10. Structure your response with clear newlines to separate sentences and paragraphs for readability.
-        11. Use bullet points for lists to make information easy to digest.
-        12. Use headers where necessary to organize information effectively and enhance reader understanding.
-        13. Sanitize the output to ensure that text is clean and consistent, avoiding any carryover of special formatting or symbols from source documents, and that text is spaced correctly with numbers.
-        14. The response should only have standard text characters, no html characters or special characters.
-        15. If you do not have enough information to provide an answer specifically from the Budget 2024 documents, ask a clarifying question so that the user can be more specific to give you enough information to answer their question.
-        16. If the user asks where they can give feedback, tell them that they can give feedback directly to the chatbot, and they can also visit official government websites or use official government feedback channels.
-        17. If the user provides feedback, acknowledge and thank them for it, using an elegant tone. If the feedback also includes a question, respond to the question. Use the chat history to determine if the user is providing feedback.
-        18. *Unless* the user has asked a question about providing feedback, add a new line, and then add the following message as a separate line at the end of your response: '\n\n---\n**If you have any feedback, you may provide it directly to this bot, visit official government websites, or use government feedback channels.**'
-        """
-         # Count input tokens using the enhanced prompt
-        input_tokens = count_tokens(enhanced_prompt, st.session_state.model)
-        st.session_state.total_input_tokens += input_tokens
+            # Prepare context from retrieved documents, merging overlapping chunks and dropping near-duplicates.
+            # Documents still visible in recent turns are referred to by label instead of being sent again.
+            context_text, context_stats = pack_context(
+                results,
+                supplied=st.session_state.memory.supplied_chunks(),
+                label_start=st.session_state.memory.next_label(),
+            )
+            st.session_state.last_context_stats = context_stats
+            print(f"Context: {context_stats['segments_used']} segments from {context_stats['chunks_retrieved']} chunks, "
+                  f"{context_stats['segments_referenced']} referenced from earlier turns, "
+                  f"{context_stats['tokens_after']} tokens ({context_stats['tokens_saved']} saved)")
+
+            # Build the question with its retrieved context, the memory adds the conversation so far
+            user_content = f"""Context from Budget 2024 documents about government schemes:
+            {context_text}
+
+            User's question: {prompt}
+            """
+            contents = st.session_state.memory.build_contents(user_content)
+
+            # Estimate input tokens locally for everything sent with this request
+            input_tokens = estimate_tokens(SYSTEM_INSTRUCTION + "\n" + contents_text(contents))
+            st.session_state.total_input_tokens += input_tokens
         
-        # Generate Gemini response with context
-        with st.chat_message("assistant"):
+            # Generate Gemini response with context
+            with st.chat_message("assistant"):
+                request_start = time.perf_counter()
 
-            # Get response from Gemini
-            response = st.session_state.chat_session.send_message(enhanced_prompt)
+                if STREAM_RESPONSES:
+                    # Render chunks as they arrive, sanitizing incrementally so split "$" signs are still escaped
+                    response = st.session_state.model.generate_content(contents, stream=True)
+                    sanitizer = StreamSanitizer()
 
-            sanitized_response_text = sanitize_text(response.text)
-            
-            # Check if the user asked how to give feedback, and don't add the footer if they did
-            # REMOVE THIS ENTIRE LINE
-            #if "give feedback" not in prompt.lower():
-            #  sanitized_response_text += ' \n\n If you have any feedback, you may provide it directly to this bot, visit official government websites, or use government feedback channels.'
+                    def stream_response():
+                        first_chunk = True
+                        for chunk in response:
+                            if first_chunk:
+                                st.session_state.last_time_to_first_token = time.perf_counter() - request_start
+                                print(f"Time to first token: {st.session_state.last_time_to_first_token:.2f}s")
+                                first_chunk = False
+                            text = sanitizer.feed(chunk.text if chunk.parts else "")
+                            if text:
+                                yield text
+                        tail = sanitizer.flush()
+                        if tail:
+                            yield tail
+
+                    sanitized_response_text = st.write_stream(stream_response())
+                else:
+                    # Get response from Gemini
+                    response = st.session_state.model.generate_content(contents)
+                    st.session_state.last_time_to_first_token = time.perf_counter() - request_start
+
+                    sanitized_response_text = sanitize_text(response.text)
+                
+                    # Check if the user asked how to give feedback, and don't add the footer if they did
+                    # REMOVE THIS ENTIRE LINE
+                    #if "give feedback" not in prompt.lower():
+                    #  sanitized_response_text += ' \n\n If you have any feedback, you may provide it directly to this bot, visit official government websites, or use government feedback channels.'
 
-            st.markdown(sanitized_response_text)
+                    st.markdown(sanitized_response_text)
             
-            # Count response tokens
-            output_tokens = count_tokens(response.text, st.session_state.model)
-            st.session_state.total_output_tokens += output_tokens
-        
-        # Classify the message
-        chat_history_for_classification = ""
-        for message in st.session_state.messages:
-            if message["role"] == "user":
-                chat_history_for_classification += f"User: {message['content']}\n"
-            elif message["role"] == "assistant":
-               chat_history_for_classification += f"Assistant: {message['content']}\n"
-        
-        classification = classify_message(chat_history_for_classification, prompt, st.session_state.model)
-        
-        # Get the previous assistant message if it exists
-        previous_assistant_message = None
-        for message in reversed(st.session_state.messages):
-            if message["role"] == "assistant":
-                previous_assistant_message = message["content"]
-                break
+                # Estimate response tokens locally
+                output_tokens = estimate_tokens(response.text)
+                st.session_state.total_output_tokens += output_tokens
+
+            # Remember the turn as it was sent, older turns are summarized in the background
+            st.session_state.memory.add_turn(prompt, user_content, response.text, summary_model=summary_model, supplied_chunks=context_stats["new_chunk_labels"])
+
+            # Cache the answer so the same first-turn question can be served without generation.
+            # The question is kept on disk and the answer shared with other sessions, so only with consent
+            if is_first_turn and st.session_state.consent:
+                answer_cache.store(prompt, query_embedding, sanitized_response_text)
         
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": sanitized_response_text})
         
-        # Save the entire chat history for this interaction only if the user gave consent
+        # Classify and save this interaction in the background, only if the user gave consent
         if st.session_state.consent:
-            save_chat_history(prompt, sanitized_response_text, st.session_state.new_session, category=classification, previous_assistant_message = previous_assistant_message)
-        
-        # Reset new_session to False after first message
-        st.session_state.new_session = False
+            chat_history_for_classification = ""
+            for message in st.session_state.messages[:-1]:
+                if message["role"] == "user":
+                    chat_history_for_classification += f"User: {message['content']}\n"
+                elif message["role"] == "assistant":
+                   chat_history_for_classification += f"Assistant: {message['content']}\n"
+
+            postprocessing_worker.submit({
+                "user_message": prompt,
+                "assistant_message": sanitized_response_text,
+                "chat_history": chat_history_for_classification,
+                "model": classification_model,  # without the chatbot's system instruction, which would skew the classification
+                "session_id": st.session_state.session_id,
+            })
         
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
 
+# Estimated token totals, and what the context packer sent with the last question
+if len(st.session_state.messages) > 0:
+    st.sidebar.caption(f"Tokens this chat (estimated): {st.session_state.total_input_tokens} in, {st.session_state.total_output_tokens} out")
+    context_stats = st.session_state.get("last_context_stats")
+    if context_stats:
+        st.sidebar.caption(f"Last context: {context_stats['segments_used']} segments from {context_stats['chunks_retrieved']} chunks, "
+                           f"{context_stats['tokens_after']} tokens ({context_stats['tokens_saved']} saved)")
+
 # Conditionally display the "End Chat" button in the sidebar
 if len(st.session_state.messages) > 0:
     if st.sidebar.button("End Chat"):
         st.session_state.messages = []  # Clear chat history
-        st.session_state.chat_session = st.session_state.model.start_chat(history=[])  # Reset chat session
+        st.session_state.memory = ConversationMemory()  # Reset conversation memory
         st.session_state.total_input_tokens = 0
         st.session_state.total_output_tokens = 0
-        st.session_state.new_session = True  # Reset for next session
+        st.session_state.pop("last_context_stats", None)
+        st.session_state.session_id = uuid.uuid4().hex
         st.rerun()
\ No newline at end of file
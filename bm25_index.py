@@ -0,0 +1,148 @@
+import os
+import re
+import gzip
+import json
+import math
+import time
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Tuple
+
+
+# Lexical index over the budgetinfo chunks, stored next to the chroma_db folder
+BM25_INDEX_PATH = "bm25_index.json.gz"
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # reciprocal rank fusion constant
+
+# Keeps scheme names like "S&CC" and "U-Save" as single terms
+TERM_PATTERN = re.compile(r"[a-z0-9]+(?:[&\-][a-z0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i", "if", "in", "is",
+    "it", "me", "my", "of", "on", "or", "so", "that", "the", "their", "this", "to", "was", "what", "when",
+    "which", "who", "will", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into lowercase index terms, dropping stopwords."""
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index that can be saved to and loaded from disk."""
+
+    def __init__(self, ids: List[str], doc_lengths: List[int], postings: Dict[str, List[List[int]]]):
+        self.ids = ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.avg_doc_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str]) -> "BM25Index":
+        """Builds the index from chunk ids and their texts."""
+        doc_lengths = []
+        postings = {}
+        for doc_index, document in enumerate(documents):
+            terms = tokenize(document)
+            doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append([doc_index, frequency])
+        return cls(list(ids), doc_lengths, postings)
+
+    @classmethod
+    def load(cls, path: str = BM25_INDEX_PATH) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["ids"], data["doc_lengths"], data["postings"])
+
+    def save(self, path: str = BM25_INDEX_PATH):
+        """Writes the index atomically so the app never loads a half-written file."""
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "doc_lengths": self.doc_lengths, "postings": self.postings}, f)
+        os.replace(tmp_path, path)
+
+    def search(self, query: str, n_results: int = 30) -> List[Tuple[str, float]]:
+        """Returns the ids and BM25 scores of the best matching chunks."""
+        total_docs = len(self.ids)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, frequency in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_index] / self.avg_doc_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+        return [(self.ids[doc_index], score) for doc_index, score in best]
+
+
+def build_index_from_collection(collection, path: str = BM25_INDEX_PATH) -> Dict:
+    """Rebuilds the BM25 index from every chunk in the collection and saves it, returning timing statistics."""
+    start_time = time.perf_counter()
+    contents = collection.get(include=["documents"])
+    index = BM25Index.build(contents["ids"], contents["documents"])
+    index.save(path)
+    return {"documents": len(index.ids), "terms": len(index.postings), "seconds": time.perf_counter() - start_time}
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuses several ranked id lists into one, scoring each id by the sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def hybrid_query(collection, index: BM25Index, query: str, query_embedding: List[float], n_results: int = 20, n_candidates: int = 30) -> Dict:
+    """Retrieves chunks by fusing vector and BM25 rankings.
+
+    Returns a ChromaDB-style query result (ids, documents, metadatas, distances, embeddings) with
+    an extra "scores" list holding the fused scores scaled to 0..1, plus retrieval timings.
+    """
+    start_time = time.perf_counter()
+    vector_results = collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_candidates,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    vector_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    lexical_ids = [chunk_id for chunk_id, _ in index.search(query, n_candidates)] if index else []
+    lexical_seconds = time.perf_counter() - start_time
+
+    fused = reciprocal_rank_fusion([vector_results["ids"][0], lexical_ids])[:n_results]
+
+    # Gather the chunks, fetching the ones only found lexically from the collection
+    chunks = {}
+    for chunk_id, document, metadata, embedding in zip(vector_results["ids"][0], vector_results["documents"][0], vector_results["metadatas"][0], vector_results["embeddings"][0]):
+        chunks[chunk_id] = (document, metadata, embedding)
+    missing = [chunk_id for chunk_id, _ in fused if chunk_id not in chunks]
+    if missing:
+        extra = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        for chunk_id, document, metadata, embedding in zip(extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"]):
+            chunks[chunk_id] = (document, metadata, embedding)
+
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_vector = query_vector / np.linalg.norm(query_vector)
+    fused = [(chunk_id, score) for chunk_id, score in fused if chunk_id in chunks]
+    top_score = fused[0][1] if fused else 1.0
+
+    results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": [], "scores": []}
+    for chunk_id, score in fused:
+        document, metadata, embedding = chunks[chunk_id]
+        vector = np.asarray(embedding, dtype=np.float32)
+        cosine = float(vector @ query_vector / np.linalg.norm(vector))
+        results["ids"].append(chunk_id)
+        results["documents"].append(document)
+        results["metadatas"].append(metadata)
+        results["distances"].append(2 - 2 * cosine)  # squared L2 distance between unit vectors
+        results["embeddings"].append(embedding)
+        results["scores"].append(score / top_score)
+
+    # Wrap each list like collection.query() does for a single query
+    results = {key: [value] for key, value in results.items()}
+    results["timings"] = {"vector_seconds": vector_seconds, "lexical_seconds": lexical_seconds}
+    return results
@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import time
+import atexit
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+
+HISTORY_DIR = "data/chatHistory"
+EVENTS_DIR = os.path.join(HISTORY_DIR, "events")  # one append-only JSONL file per day: events_YYYY-MM-DD.jsonl
+
+FLUSH_INTERVAL = 1.0  # seconds between buffer flushes
+FSYNC_INTERVAL = 5.0  # seconds between fsyncs to disk
+MAX_BUFFERED_EVENTS = 100  # flush early once this many events are waiting
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+SEPARATOR = "-" * 40
+
+
+def events_path(day: date) -> str:
+    return os.path.join(EVENTS_DIR, f"events_{day.isoformat()}.jsonl")
+
+def make_event(session_id: str, role: str, message: str, timestamp: str, category: str = None) -> Dict:
+    """Builds one chat log event."""
+    return {"session_id": session_id, "role": role, "category": category, "timestamp": timestamp, "message": message}
+
+# ---------- Writer ----------
+
+class ChatLogWriter:
+    """Thread-safe, buffered writer for the daily event files.
+
+    Events are appended to an in-memory buffer and written out by a background thread every
+    FLUSH_INTERVAL seconds (or sooner when the buffer fills up), with an fsync at most every
+    FSYNC_INTERVAL seconds. Everything is flushed and synced on exit.
+    """
+
+    def __init__(self, events_dir: str = EVENTS_DIR, background: bool = True):
+        self.events_dir = events_dir
+        self.buffer = []
+        self.lock = threading.Lock()  # guards the buffer
+        self.file_lock = threading.Lock()  # guards the open files
+        self.files = {}
+        self.last_fsync = time.monotonic()
+        self.wake = threading.Event()
+        if background:
+            self.thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def write(self, events: List[Dict]):
+        """Queues events for writing. Events of one call are always written together, in order."""
+        with self.lock:
+            self.buffer.extend(events)
+            if len(self.buffer) >= MAX_BUFFERED_EVENTS:
+                self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing chat log: {e}")
+
+    def _file(self, day: str):
+        if day not in self.files:
+            # Keep only the current day's file open
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+            os.makedirs(self.events_dir, exist_ok=True)
+            self.files[day] = open(os.path.join(self.events_dir, f"events_{day}.jsonl"), "a", encoding="utf-8")
+        return self.files[day]
+
+    def flush(self, sync: bool = False):
+        """Writes buffered events to their daily files, syncing to disk if due or requested."""
+        with self.lock:
+            events, self.buffer = self.buffer, []
+        with self.file_lock:
+            for i, event in enumerate(events):
+                try:
+                    self._file(event["timestamp"][:10]).write(json.dumps(event, ensure_ascii=False) + "\n")
+                except Exception:
+                    # Put unwritten events back so the next flush retries them
+                    with self.lock:
+                        self.buffer = events[i:] + self.buffer
+                    raise
+            for f in self.files.values():
+                f.flush()
+                if sync or time.monotonic() - self.last_fsync >= FSYNC_INTERVAL:
+                    os.fsync(f.fileno())
+            if sync or time.monotonic() - self.last_fsync >= FSYNC_INTERVAL:
+                self.last_fsync = time.monotonic()
+
+    def close(self):
+        self.flush(sync=True)
+        with self.file_lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> ChatLogWriter:
+    """Returns the process-wide chat log writer, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ChatLogWriter()
+        return _writer
+
+# ---------- Readers and Views ----------
+
+def read_events(start_date: date, end_date: date, category: str = None, role: str = None) -> Iterator[Dict]:
+    """Yields the logged events between two dates (inclusive), optionally filtered by category and role."""
+    day = start_date
+    while day <= end_date:
+        path = events_path(day)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    if (category is None or event.get("category") == category) and (role is None or event["role"] == role):
+                        yield event
+        day += timedelta(days=1)
+
+def read_feedback(start_date: date, end_date: date) -> List[Dict]:
+    """Returns the user messages classified as feedback between two dates."""
+    return list(read_events(start_date, end_date, category="feedback", role="user"))
+
+def transcript_lines(start_date: date, end_date: date) -> List[str]:
+    """Returns the conversations between two dates as "role: message<TAB>timestamp" lines."""
+    return [f"{event['role']}: {event['message']}\t{event['timestamp']}" for event in read_events(start_date, end_date)]
+
+def export_legacy(start_date: date, end_date: date, history_dir: str = HISTORY_DIR):
+    """Regenerates the legacy per-day text files (full history, normalchat, feedback, purefeedback) from the event log."""
+    day = start_date
+    while day <= end_date:
+        events = list(read_events(day, day))
+        if events:
+            write_legacy_day(day, events, history_dir)
+        day += timedelta(days=1)
+
+def write_legacy_day(day: date, events: List[Dict], history_dir: str):
+    today = day.isoformat()
+    paths = {
+        "history": os.path.join(history_dir, f"{today}.txt"),
+        "normalchat": os.path.join(history_dir, "normalchat", f"normalchat_{today}.txt"),
+        "feedback": os.path.join(history_dir, "feedback", f"feedback_{today}.txt"),
+        "purefeedback": os.path.join(history_dir, "purefeedback", f"purefeedback_{today}.txt"),
+    }
+    lines = {name: [] for name in paths}
+    seen_sessions = set()
+    last_assistant = {}
+    for event in events:
+        session_id = event["session_id"]
+        if event["role"] == "user":
+            if session_id not in seen_sessions:
+                seen_sessions.add(session_id)
+                lines["history"].append(f"Session started at: {event['timestamp']}\n{SEPARATOR}\n\n")
+            user_line = f"user: {event['message']}\t{event['timestamp']}\n\n"
+            lines["history"].append(user_line)
+            if event.get("category") == "normalchat":
+                lines["normalchat"].append(user_line)
+            elif event.get("category") == "feedback":
+                if last_assistant.get(session_id):
+                    lines["feedback"].append(f"assistant: {last_assistant[session_id]}\n\n")
+                lines["feedback"].append(user_line)
+                lines["purefeedback"].append(user_line)
+        else:
+            lines["history"].append(f"assistant: {event['message']}\n\n{SEPARATOR}\n\n")
+            last_assistant[session_id] = event["message"]
+
+    for name, path in paths.items():
+        if lines[name]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(lines[name])
+
+# ---------- Migration ----------
+
+LEGACY_USER_LINE = re.compile(r"^user:\s*(.*?)\s*(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s*$", re.DOTALL)
+LEGACY_TURN = re.compile(r"^user: (.*?)\t(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\n\nassistant: (.*?)\s*$", re.DOTALL)
+
+def parse_legacy_user_lines(path: str) -> List[tuple]:
+    """Parses "user: message<TAB or space>timestamp" entries from a legacy categorized file."""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for block in f.read().split("\n\n"):
+            block = block.strip()
+            if block.startswith("user:"):
+                match = LEGACY_USER_LINE.match(block)
+                if match:
+                    entries.append((match.group(1).strip(), match.group(2)))
+    return entries
+
+def migrate_legacy_history(history_dir: str = HISTORY_DIR) -> int:
+    """Converts the legacy text files under history_dir into the event log, once. Returns the number of events written."""
+    events_dir = os.path.join(history_dir, "events")
+    marker = os.path.join(events_dir, ".migrated")
+    if os.path.exists(marker):
+        print("Chat history has already been migrated")
+        return 0
+
+    # Categories of user messages, from the normalchat, feedback and purefeedback files
+    categories = {}
+    for category, folder, prefix in (("normalchat", "normalchat", "normalchat_"), ("feedback", "feedback", "feedback_"), ("feedback", "purefeedback", "purefeedback_")):
+        folder_path = os.path.join(history_dir, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for filename in sorted(os.listdir(folder_path)):
+            if filename.startswith(prefix) and filename.endswith(".txt"):
+                for entry in parse_legacy_user_lines(os.path.join(folder_path, filename)):
+                    categories.setdefault(entry, category)
+
+    events = []
+    matched = set()
+    for filename in sorted(os.listdir(history_dir)):
+        if not re.fullmatch(r"\d{4}-\d{2}-\d{2}\.txt", filename):
+            continue
+        with open(os.path.join(history_dir, filename), "r", encoding="utf-8") as f:
+            content = f.read()
+        session_id = None
+        for block in content.split(f"{SEPARATOR}\n\n"):
+            block = block.strip("\n")
+            if block.startswith("Session started at:"):
+                session_id = f"legacy-{block.split(':', 1)[1].strip().replace(' ', 'T')}"
+                continue
+            match = LEGACY_TURN.match(block)
+            if not match:
+                continue
+            message, timestamp, answer = match.groups()
+            session_id = session_id or f"legacy-{timestamp.replace(' ', 'T')}"
+            category = categories.get((message.strip(), timestamp))
+            matched.add((message.strip(), timestamp))
+            events.append(make_event(session_id, "user", message, timestamp, category))
+            events.append(make_event(session_id, "assistant", answer, timestamp))
+
+    # Categorized messages with no full transcript (e.g. entered by hand) become single-message sessions
+    for (message, timestamp), category in categories.items():
+        if (message, timestamp) not in matched:
+            events.append(make_event(f"legacy-{category}-{timestamp.replace(' ', 'T')}", "user", message, timestamp, category))
+
+    # Keep each session's events together, sessions in the order they started
+    session_start = {}
+    for event in events:
+        session_start.setdefault(event["session_id"], event["timestamp"])
+    events.sort(key=lambda event: session_start[event["session_id"]])
+
+    writer = ChatLogWriter(events_dir, background=False)
+    writer.write(events)
+    writer.close()
+
+    os.makedirs(events_dir, exist_ok=True)
+    with open(marker, "w", encoding="utf-8") as f:
+        f.write(datetime.now().strftime(TIMESTAMP_FORMAT) + "\n")
+    return len(events)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        print(f"Migrated {migrate_legacy_history()} events to {EVENTS_DIR}")
+    elif len(sys.argv) > 3 and sys.argv[1] == "export":
+        export_legacy(date.fromisoformat(sys.argv[2]), date.fromisoformat(sys.argv[3]))
+        print(f"Exported legacy files to {HISTORY_DIR}")
+    else:
+        print("Usage: python chat_log.py migrate | export YYYY-MM-DD YYYY-MM-DD")
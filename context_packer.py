@@ -0,0 +1,158 @@
+import re
+import numpy as np
+from typing import Dict, List, Tuple
+from functions import CHUNK_OVERLAP
+from token_estimator import estimate_tokens
+
+
+CONTEXT_TOKEN_BUDGET = 8000
+MMR_LAMBDA = 0.7  # trade-off between relevance (1.0) and diversity (0.0)
+NEAR_DUPLICATE_SIMILARITY = 0.95  # segments this similar to one already chosen are dropped
+
+# Official sources are preferred over commentary when relevance is otherwise close
+OFFICIAL_SOURCE_MARKERS = ["budget_statement", "Budget 2024.pdf", "Budget Navigator", "SupportGoWhere"]
+COMMENTARY_AUTHORITY = 0.9
+
+CHUNK_ID_PATTERN = re.compile(r"_chunk_(\d+)$")
+
+
+def source_authority(source: str) -> float:
+    """Returns a weight for how authoritative a source document is."""
+    return 1.0 if any(marker in source for marker in OFFICIAL_SOURCE_MARKERS) else COMMENTARY_AUTHORITY
+
+def chunk_index(chunk_id: str, metadata: Dict) -> int:
+    """Returns a chunk's position within its page, from metadata or (for older indexes) its id."""
+    if "chunk" in metadata:
+        return metadata["chunk"]
+    match = CHUNK_ID_PATTERN.search(chunk_id)
+    return int(match.group(1)) if match else 0
+
+def merge_overlapping(first: str, second: str) -> str:
+    """Joins two consecutive chunks, removing the overlapping text the chunker repeated between them."""
+    probe = second[:50]
+    search_from = max(0, len(first) - CHUNK_OVERLAP - len(probe))
+    start = first.rfind(probe, search_from)
+    if start != -1 and second.startswith(first[start:]):
+        return first[:start] + second
+    return f"{first} {second}"
+
+def build_segments(ids: List[str], documents: List[str], metadatas: List[Dict], relevances: List[float], embeddings) -> List[Dict]:
+    """Groups retrieved chunks into segments, merging chunks that are adjacent on the same source page."""
+    chunks = []
+    for chunk_id, document, metadata, relevance, embedding in zip(ids, documents, metadatas, relevances, embeddings):
+        chunks.append({
+            "id": chunk_id,
+            "source": metadata.get("source", ""),
+            "page": metadata.get("page", 0),
+            "chunk": chunk_index(chunk_id, metadata),
+            "text": document,
+            "relevance": relevance,
+            "embedding": np.asarray(embedding, dtype=np.float32),
+        })
+    chunks.sort(key=lambda c: (c["source"], c["page"], c["chunk"]))
+
+    segments = []
+    for chunk in chunks:
+        previous = segments[-1] if segments else None
+        if previous and (previous["source"], previous["page"]) == (chunk["source"], chunk["page"]) and previous["last_chunk"] + 1 == chunk["chunk"]:
+            previous["text"] = merge_overlapping(previous["text"], chunk["text"])
+            previous["relevance"] = max(previous["relevance"], chunk["relevance"])
+            previous["embeddings"].append(chunk["embedding"])
+            previous["ids"].append(chunk["id"])
+            previous["last_chunk"] = chunk["chunk"]
+        else:
+            segments.append({
+                "source": chunk["source"],
+                "page": chunk["page"],
+                "last_chunk": chunk["chunk"],
+                "text": chunk["text"],
+                "relevance": chunk["relevance"],
+                "embeddings": [chunk["embedding"]],
+                "ids": [chunk["id"]],
+            })
+
+    for segment in segments:
+        embedding = np.mean(segment.pop("embeddings"), axis=0)
+        norm = np.linalg.norm(embedding)
+        segment["embedding"] = embedding / norm if norm else embedding
+        segment["score"] = segment["relevance"] * source_authority(segment["source"])
+    return segments
+
+def select_segments(segments: List[Dict], token_budget: int) -> List[Dict]:
+    """Picks segments by maximal marginal relevance, skipping near-duplicates, until the token budget is spent."""
+    selected = []
+    remaining = list(segments)
+    tokens_used = 0
+    while remaining:
+        if selected:
+            chosen = np.array([segment["embedding"] for segment in selected])
+            redundancy = [float(np.max(chosen @ segment["embedding"])) for segment in remaining]
+        else:
+            redundancy = [0.0] * len(remaining)
+
+        best = max(range(len(remaining)), key=lambda i: MMR_LAMBDA * remaining[i]["score"] - (1 - MMR_LAMBDA) * redundancy[i])
+        segment = remaining.pop(best)
+        if redundancy[best] >= NEAR_DUPLICATE_SIMILARITY:
+            continue
+
+        segment["tokens"] = estimate_tokens(segment["text"])
+        if tokens_used + segment["tokens"] > token_budget:
+            continue  # a smaller segment further down may still fit
+        selected.append(segment)
+        tokens_used += segment["tokens"]
+    return selected
+
+def pack_context(results: Dict, token_budget: int = CONTEXT_TOKEN_BUDGET, supplied: Dict[str, str] = None, label_start: int = 1) -> Tuple[str, Dict]:
+    """Assembles the prompt context from a ChromaDB query result within a token budget.
+
+    The result must include documents, metadatas, distances and embeddings. Relevance is taken from
+    the distances, or from a "scores" list when the result comes from hybrid_query.
+
+    supplied maps chunk ids already sent earlier in the conversation (and still visible to the model)
+    to their document labels. Segments made up only of those chunks are referred to by label instead
+    of being sent again; they still count against the token budget, since the model reads them. New
+    segments are labelled D<label_start>, D<label_start + 1>, ... so later turns can refer to them.
+
+    Returns the context text and statistics comparing it with joining every retrieved chunk,
+    including new_chunk_labels, the chunk id to label mapping of the segments sent this turn.
+    """
+    supplied = supplied or {}
+    documents = results["documents"][0]
+    if "scores" in results:
+        relevances = results["scores"][0]
+    else:
+        relevances = [1 - (distance / 2) for distance in results["distances"][0]]
+    segments = build_segments(results["ids"][0], documents, results["metadatas"][0], relevances, results["embeddings"][0])
+    selected = select_segments(segments, token_budget)
+    selected.sort(key=lambda segment: segment["score"], reverse=True)
+
+    new_segments = []
+    referenced_labels = []
+    new_chunk_labels = {}
+    for segment in selected:
+        if all(chunk_id in supplied for chunk_id in segment["ids"]):
+            for chunk_id in segment["ids"]:
+                if supplied[chunk_id] not in referenced_labels:
+                    referenced_labels.append(supplied[chunk_id])
+        else:
+            segment["label"] = f"D{label_start + len(new_segments)}"
+            new_segments.append(segment)
+            for chunk_id in segment["ids"]:
+                new_chunk_labels[chunk_id] = segment["label"]
+
+    blocks = [f"[{segment['label']}] [Source: {segment['source']}, page {segment['page'] + 1}]\n{segment['text']}" for segment in new_segments]
+    if referenced_labels:
+        blocks.append(f"Also relevant, documents supplied earlier in this conversation: {', '.join(referenced_labels)}")
+    context = "\n\n".join(blocks)
+
+    tokens_before = estimate_tokens(" ".join(documents))
+    tokens_after = estimate_tokens(context)
+    return context, {
+        "chunks_retrieved": len(documents),
+        "segments_used": len(selected),
+        "segments_referenced": len(selected) - len(new_segments),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "new_chunk_labels": new_chunk_labels,
+    }
@@ -0,0 +1,168 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from token_estimator import estimate_tokens
+
+
+WINDOW_TURNS = 3  # most recent turns sent verbatim
+HISTORY_TOKEN_CEILING = 24000  # tokens of summary and recent turns sent with each question
+SUMMARY_MAX_WORDS = 200
+
+# Older turns are folded into the summary off the response path
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+
+class ConversationMemory:
+    """Per-session chat memory: a sliding window of recent turns plus a rolling summary of older ones.
+
+    Each generation call is stateless and receives the summary, the recent turns and the new
+    question, so history is sent exactly once and its size stays flat however long the session runs.
+    """
+
+    def __init__(self, window_turns: int = WINDOW_TURNS, token_ceiling: int = HISTORY_TOKEN_CEILING):
+        self.window_turns = window_turns
+        self.token_ceiling = token_ceiling
+        self.summary = ""
+        self.turns = []  # recent turns: {"user": content as sent, "question": str, "assistant": str, "chunks": {chunk id: label}, "tokens": int}
+        self.labels_used = 0  # document labels handed out this session
+        self.unsummarized = []  # evicted turns waiting to be folded into the summary
+        self.lock = threading.Lock()
+        self.summary_lock = threading.Lock()  # one summary update at a time, so none is based on a stale summary
+
+    def build_contents(self, user_content: str) -> List[Dict]:
+        """Returns the generate_content contents for a new question: summary, recent turns, then the question."""
+        with self.lock:
+            contents = []
+            earlier = self.summary
+            if self.unsummarized:
+                # Turns evicted before their summary finished are still passed on, without their context
+                earlier += "\n" + "\n".join(f"User: {turn['question']}\nAssistant: {turn['assistant']}" for turn in self.unsummarized)
+            if earlier.strip():
+                contents.append({"role": "user", "parts": [f"Summary of the earlier conversation:\n{earlier.strip()}"]})
+                contents.append({"role": "model", "parts": ["Understood, I will keep this in mind."]})
+            for turn in self.turns:
+                contents.append({"role": "user", "parts": [turn["user"]]})
+                contents.append({"role": "model", "parts": [turn["assistant"]]})
+            contents.append({"role": "user", "parts": [user_content]})
+            return contents
+
+    def supplied_chunks(self) -> Dict[str, str]:
+        """Returns the chunk ids, with their document labels, whose text is in a turn still inside the window.
+
+        A chunk supplied by a turn that has been evicted is no longer visible to the model, so it is
+        left out here and will be sent again (under a new label) if it is retrieved again.
+        """
+        with self.lock:
+            supplied = {}
+            for turn in self.turns:
+                supplied.update(turn["chunks"])
+            return supplied
+
+    def next_label(self) -> int:
+        """Returns the number to give the next document label."""
+        with self.lock:
+            return self.labels_used + 1
+
+    def add_turn(self, question: str, user_content: str, assistant_message: str, summary_model=None, supplied_chunks: Dict[str, str] = None):
+        """Records a finished turn, evicting old turns past the window or token ceiling into the summary."""
+        with self.lock:
+            supplied_chunks = supplied_chunks or {}
+            self.labels_used += len(set(supplied_chunks.values()))
+            self.turns.append({
+                "user": user_content,
+                "question": question,
+                "assistant": assistant_message,
+                "chunks": supplied_chunks,
+                "tokens": estimate_tokens(user_content) + estimate_tokens(assistant_message),
+            })
+            evicted = []
+            while len(self.turns) > self.window_turns or (len(self.turns) > 1 and self.history_tokens() > self.token_ceiling):
+                evicted.append(self.turns.pop(0))
+            self.unsummarized.extend(evicted)
+        if evicted and summary_model is not None:
+            summary_executor.submit(self.summarize, summary_model)
+        return evicted
+
+    def history_tokens(self) -> int:
+        """Estimated tokens of summary and recent turns sent with each question."""
+        return estimate_tokens(self.summary) + sum(turn["tokens"] for turn in self.turns)
+
+    def summarize(self, model):
+        """Folds evicted turns into the rolling summary with one model call."""
+        with self.summary_lock:
+            with self.lock:
+                pending = list(self.unsummarized)
+                previous_summary = self.summary
+            if not pending:
+                return
+            transcript = "\n".join(f"User: {turn['question']}\nAssistant: {turn['assistant']}" for turn in pending)
+            summary_prompt = f"""You are maintaining a running summary of a conversation between a citizen and a chatbot about government schemes.
+
+            Instructions:
+            1. Update the existing summary with the new conversation turns below.
+            2. Keep the user's circumstances, the schemes discussed, and any specific figures, dates and eligibility details given.
+            3. Keep any feedback the user has given.
+            4. Return ONLY the updated summary, in at most {SUMMARY_MAX_WORDS} words.
+
+            Existing Summary:
+            {previous_summary or "(none)"}
+
+            New Conversation Turns:
+            {transcript}
+            """
+            try:
+                response = model.generate_content(summary_prompt)
+                new_summary = response.text.strip()
+            except Exception as e:
+                print(f"Error summarizing conversation, keeping turns unsummarized: {e}")
+                return
+            with self.lock:
+                # Only drop the turns this summary covers, more may have been evicted meanwhile
+                self.unsummarized = self.unsummarized[len(pending):]
+                self.summary = new_summary
+
+
+def contents_text(contents: List[Dict]) -> str:
+    """Joins the text of generate_content contents, for token estimates."""
+    return "\n".join(part for content in contents for part in content["parts"])
+
+
+if __name__ == "__main__":
+    # Compare prompt tokens per turn on a scripted 10-turn conversation, with and without
+    # cross-turn context deduplication. Only retrieval runs, answers are fixed placeholders.
+    from functions import create_embedding
+    from context_packer import pack_context
+    from bm25_index import hybrid_query
+    from resources import get_collection, get_bm25_index
+
+    scripted_questions = [
+        "What is the Cost-of-Living Special Payment?",
+        "Am I eligible for it if I earn $30,000 a year?",
+        "How much will I receive?",
+        "When will it be paid?",
+        "What about the CDC vouchers this year?",
+        "How do I claim the CDC vouchers?",
+        "Are there U-Save rebates for my HDB flat?",
+        "How much U-Save will a 4-room flat get?",
+        "What support is there for seniors, like the MediSave Bonus?",
+        "Can you summarise the cost of living support we discussed?",
+    ]
+    placeholder_answer = "Here is the information from the Budget 2024 documents about your question. " * 10
+
+    collection = get_collection()
+    bm25_index = get_bm25_index()
+    retrieved = []
+    for question in scripted_questions:
+        retrieved.append(hybrid_query(collection, bm25_index, question, create_embedding(question), n_results=20))
+
+    for dedup in (False, True):
+        memory = ConversationMemory()
+        per_turn = []
+        for question, results in zip(scripted_questions, retrieved):
+            supplied = memory.supplied_chunks() if dedup else {}
+            context_text, stats = pack_context(results, supplied=supplied, label_start=memory.next_label())
+            user_content = f"Context from Budget 2024 documents about government schemes:\n{context_text}\n\nUser's question: {question}"
+            per_turn.append(estimate_tokens(contents_text(memory.build_contents(user_content))))
+            memory.add_turn(question, user_content, placeholder_answer, supplied_chunks=stats["new_chunk_labels"])
+        label = "with deduplication" if dedup else "without deduplication"
+        print(f"Prompt tokens per turn {label}: {per_turn} (total {sum(per_turn)})")
@@ -3,9 +3,16 @@ import datetime
 import plotly.graph_objects as go
 import pandas as pd
 import os
-from functions import process_data, get_all_feedback_data, summarize_feedback
+import tempfile
+from functions import process_rollup
+from feedback_store import PREPROCESSED_DIR, RUNS_PATH, run_label, load_runs, find_run, delete_run, read_feedback_range, stored_dates, migrate_range_files, ensure_run_counts, run_metrics, range_signature, file_signature, read_rollup, write_csv, ROLLUP_PATH
+from frame_cache import FrameCache
+from feedback_index import FeedbackIndex, PAGE_SIZES
+from preprocess_jobs import JobRunner, job_throughput
 from datetime import date, timedelta
 
+JOB_REFRESH_SECONDS = 2  # how often the preprocessing job list refreshes while a job is queued or running
+
 # Page configuration
 st.set_page_config(
     page_title="Feedback Analysis Dashboard",
@@ -50,17 +57,17 @@ if selected_section == "Preprocess Data":
 elif selected_section == "Overview Report":
     st.sidebar.write("""
         Use this section to view a high-level summary of the feedback.
-        Select a preprocessed data file to load feedback data.
+        Select preprocessed data to load feedback data.
     """)
 elif selected_section == "Visual Charts":
         st.sidebar.write("""
         Use this section to visualize the feedback data with charts.
-        Select a preprocessed data file to load feedback data.
+        Select preprocessed data, or any date range of the stored feedback, to load feedback data.
     """)
 elif selected_section == "View Feedback":
         st.sidebar.write("""
         Use this section to view the individual feedback data.
-        Select preprocessed data to view, and filter by category and sentiment.
+        Select preprocessed data, or any date range of the stored feedback, and filter by category and sentiment.
     """)
 elif selected_section == "Settings":
         st.sidebar.write("""
@@ -70,55 +77,127 @@ elif selected_section == "Settings":
 st.sidebar.markdown("---")
 
 # --- Data Loading Logic ---
-def load_preprocessed_data(filename):
-    try:
-        # Construct the full file path
-        file_path = os.path.join("data/preprocessed", filename)
-        if filename.endswith(".csv"):
-           df = pd.read_csv(file_path)
-        elif filename.endswith(".parquet"):
-            df = pd.read_parquet(file_path)
-        else:
-            raise ValueError("Unsupported file type")
-        return df
-    except FileNotFoundError:
-        st.error(f"File not found: {filename}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error loading file {filename}: {e}")
-        return pd.DataFrame()
-
-def save_preprocessed_data(df, start_date, end_date):
-    # Format the date range to create the filename
-    formatted_date_range = f"{start_date.strftime('%b %d, %Y')} - {end_date.strftime('%b %d, %Y')}"
-    os.makedirs("data/preprocessed", exist_ok=True)
-    file_path_parquet = os.path.join("data/preprocessed", f"{formatted_date_range}.parquet")
-    file_path_csv = os.path.join("data/preprocessed", f"{formatted_date_range}.csv")
-    
-    try:
-        # Generate the AI summary before saving
-        ai_summary = summarize_feedback(df)
-        df['ai_summary'] = ai_summary # Add the ai_summary as a column
-        df.to_parquet(file_path_parquet, index = False)
-        df.to_csv(file_path_csv, index=False)
-        st.success(f"Data saved to {formatted_date_range}.parquet and {formatted_date_range}.csv")
-    except Exception as e:
-        st.error(f"Error saving data: {e}")
+# Enriched feedback lives in one date-partitioned Parquet dataset (see feedback_store.py), and each
+# "Process Data" run is recorded with its date range, AI summary and counts. Loading the rows of a run,
+# or of any other range of stored days, is a filtered scan, done only by the pages that need them.
+@st.cache_resource
+def import_legacy_preprocessed_files():
+    """Imports per-range Parquet files written by older versions into the feedback store, once per process."""
+    migrate_range_files()
+    return True
+
+import_legacy_preprocessed_files()
+
+# Loaded runs, feedback indexes and aggregates, shared by every page and session in this process and
+# keyed by the signature of the files they came from, so they are only recomputed when those change
+@st.cache_resource
+def get_frame_cache():
+    return FrameCache()
+
+frame_cache = get_frame_cache()
+
+# Preprocessing runs in a background job runner shared by every session, so it survives reruns and
+# browser refreshes, and jobs interrupted by a restart resume when the runner is created again
+@st.cache_resource
+def get_job_runner():
+    return JobRunner()
+
+job_runner = get_job_runner()
+
+def cached_runs():
+    return frame_cache.get_or_compute(("runs", file_signature(RUNS_PATH)), load_runs)
+
+def select_feedback_range():
+    """Returns the (start, end) dates to load, from a preprocessed run or picked directly from the stored days."""
+    source = st.radio("Load feedback from:", ["Preprocessed data", "Custom date range"], horizontal=True)
+    if source == "Preprocessed data":
+        runs = cached_runs()
+        if not runs:
+            st.warning("No preprocessed data available, please process the data in the Preprocess Data tab")
+            return None
+        run = find_run(runs, st.selectbox("Select preprocessed data:", [run["label"] for run in runs]))
+        return date.fromisoformat(run["start_date"]), date.fromisoformat(run["end_date"])
+    # Any range of the stored days is a filtered scan of the partitions, no preprocessing run needed
+    days = stored_dates()
+    if not days:
+        st.warning("No processed feedback stored yet, please process the data in the Preprocess Data tab")
+        return None
+    col1, col2 = st.columns(2)
+    with col1:
+        start_date = st.date_input("Start Date", days[0], min_value=days[0], max_value=days[-1])
+    with col2:
+        end_date = st.date_input("End Date", days[-1], min_value=days[0], max_value=days[-1])
+    if start_date > end_date:
+        st.error("Start date must be before end date!")
+        return None
+    return start_date, end_date
+
+def load_aggregates(start_date, end_date):
+    """Returns the chart data of a date range from the daily rollup, so its cost depends on the days in the range, not the rows."""
+    return frame_cache.get_or_compute(("aggregates", start_date, end_date, file_signature(ROLLUP_PATH)), lambda: process_rollup(read_rollup(start_date, end_date)))
 
-def delete_preprocessed_data(filename):
-    file_path = os.path.join("data/preprocessed", filename)
+def load_feedback_index(start_date, end_date):
+    """Returns the filter and search index of a date range's feedback, built once per version of its files."""
+    return frame_cache.get_or_compute(("index", start_date, end_date, range_signature(start_date, end_date)), lambda: FeedbackIndex(read_feedback_range(start_date, end_date)))
+
+def prepare_csv_export(start_date, end_date):
+    """Writes a date range's feedback to a temporary CSV file, one day and batch of rows at a time, and returns its path."""
+    with tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False) as export:
+        write_csv(start_date, end_date, export)
+    return export.name
+
+def delete_preprocessed_data(label):
     try:
-      os.remove(file_path)
-      if filename.endswith(".parquet"):
-         os.remove(file_path.replace(".parquet", ".csv"))
-      elif filename.endswith(".csv"):
-        os.remove(file_path.replace(".csv", ".parquet"))
-      st.success(f"Successfully deleted: {filename}")
+      delete_run(label)
+      # Remove the per-range Parquet and CSV files that older versions wrote for each run
+      for extension in (".csv", ".parquet"):
+         file_path = os.path.join(PREPROCESSED_DIR, f"{label}{extension}")
+         if os.path.exists(file_path):
+            os.remove(file_path)
+      st.success(f"Successfully deleted: {label}")
     except FileNotFoundError:
-        st.error(f"Error: File not found {filename}")
+        st.error(f"Error: Preprocessed data not found {label}")
     except Exception as e:
-        st.error(f"Error deleting file {filename}: {e}")
+        st.error(f"Error deleting {label}: {e}")
+
 
+def show_jobs():
+    """Shows the progress of queued and running preprocessing jobs, and the outcome of recent ones.
+
+    The job list only refreshes itself while a job is queued or running. When one finishes the whole
+    page reruns, so the lists of preprocessed data include its range and the refreshing stops once
+    nothing is left to wait for.
+    """
+    active_labels = set(job_runner.table.active_labels())
+    st.session_state.active_job_labels = active_labels
+    st.fragment(run_every=JOB_REFRESH_SECONDS if active_labels else None)(show_job_list)()
+
+def show_job_list():
+    active_labels = set(job_runner.table.active_labels())
+    if st.session_state.get("active_job_labels", set()) - active_labels:
+        st.rerun()
+    jobs = job_runner.table.jobs()
+    if not jobs:
+        st.write("No preprocessing jobs yet.")
+        return
+    for job in jobs:
+        if job["status"] == "running":
+            progress = job["done"] / job["total"] if job["total"] else 0.0
+            st.progress(progress, text=f"{job['label']}: {job['stage']}, {job['done']} of {job['total']} entries labelled ({job_throughput(job):.1f} entries/s)")
+        elif job["status"] == "queued":
+            st.write(f"{job['label']}: queued" + (" (resuming after a restart)" if job["stage"] == "interrupted" else ""))
+    finished = [job for job in jobs if job["status"] in ("done", "failed")]
+    if finished:
+        st.dataframe(
+            pd.DataFrame([{
+                "Date Range": job["label"],
+                "Status": job["status"] if job["status"] == "failed" else job["stage"],
+                "Entries": job["total"],
+                "Finished": datetime.datetime.fromtimestamp(job["finished_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+                "Error": job["error"] or "",
+            } for job in finished]),
+            hide_index=True,
+        )
 
 # --- Preprocess Data Page ---
 if selected_section == "Preprocess Data":
@@ -134,31 +213,31 @@ if selected_section == "Preprocess Data":
     if start_date > end_date:
         st.error("Start date must be before end date!")
     else:
-        # File Exists Check
-        formatted_date_range = f"{start_date.strftime('%b %d, %Y')} - {end_date.strftime('%b %d, %Y')}"
-        file_path_parquet = os.path.join("data/preprocessed", f"{formatted_date_range}.parquet")
-        file_path_csv = os.path.join("data/preprocessed", f"{formatted_date_range}.csv")
-        if os.path.exists(file_path_parquet) and os.path.exists(file_path_csv):
-          st.warning(f"A preprocessed data file already exists for {formatted_date_range}. You can delete it below, or select a new date range.")
+        # Run Exists Check
+        formatted_date_range = run_label(start_date, end_date)
+        if find_run(cached_runs(), formatted_date_range):
+          st.warning(f"Preprocessed data already exists for {formatted_date_range}. You can delete it below, or select a new date range.")
         else:
-          if st.button("Process Data"):
-              with st.spinner("Processing data..."):
-                  df = get_all_feedback_data(start_date, end_date)
-                  if not df.empty:
-                    save_preprocessed_data(df, start_date, end_date)
-                  else:
-                      st.warning("No feedback found for the selected date range.")
+          if formatted_date_range in job_runner.table.active_labels():
+              st.info(f"{formatted_date_range} is already queued for processing, its progress is shown below.")
+          elif st.button("Process Data"):
+              job_runner.submit(start_date, end_date)
+              st.success(f"Queued {formatted_date_range} for processing. You can leave this page, processing continues in the background.")
     
+    st.markdown("---")
+    st.markdown("<h3><span style='border-bottom: 2px solid #FFF;'>Processing Jobs</span></h3>", unsafe_allow_html=True)
+    show_jobs()
+
     st.markdown("---")
     # List existing files
     st.markdown("<h3><span style='border-bottom: 2px solid #FFF;'>Existing Preprocessed Data</span></h3>", unsafe_allow_html=True)
-    st.write("Select preprocessed files to delete.")
-    preprocessed_files = [f for f in os.listdir("data/preprocessed") if f.endswith(".parquet")]
-    if preprocessed_files:
-        selected_files_to_delete = st.multiselect("Select files to delete", preprocessed_files)
-        if st.button("Delete Selected Files"):
-            for file_to_delete in selected_files_to_delete:
-                delete_preprocessed_data(file_to_delete)
+    st.write("Select preprocessed data to delete.")
+    preprocessed_runs = [run["label"] for run in cached_runs()]
+    if preprocessed_runs:
+        selected_runs_to_delete = st.multiselect("Select data to delete", preprocessed_runs)
+        if st.button("Delete Selected Data"):
+            for run_to_delete in selected_runs_to_delete:
+                delete_preprocessed_data(run_to_delete)
     else:
         st.write("No preprocessed data found.")
     
@@ -169,27 +248,31 @@ elif selected_section == "Overview Report":
     st.markdown("---")
     st.write("Select preprocessed data to view from the box below.")
 
-    # Load Preprocessed Data
-    preprocessed_files = [f for f in os.listdir("data/preprocessed") if f.endswith(".parquet")]
-    if preprocessed_files:
-      selected_file = st.selectbox("Select preprocessed data:", preprocessed_files)
-      if selected_file:
-        df = load_preprocessed_data(selected_file)
+    # Load Preprocessed Data (run metadata only, this page needs no feedback rows)
+    runs = cached_runs()
+    run = None
+    if runs:
+      selected_run = st.selectbox("Select preprocessed data:", [run["label"] for run in runs])
+      run = find_run(runs, selected_run)
     else:
-      df = pd.DataFrame()
       st.warning("No preprocessed data available, please process the data in the Preprocess Data tab")
 
-    if not df.empty:
-        overall_sentiment, total_feedback, positive_feedback, negative_feedback, category_counts, segments, df_monthly = process_data(df)
-        ai_summary = df['ai_summary'].iloc[0]
+    if run:
+        run = ensure_run_counts(run)
+        overall_sentiment, total_feedback, positive_feedback, negative_feedback = run_metrics(run)
+        ai_summary = run["ai_summary"]
         # Section for the first row
         st.markdown("---")
         st.subheader(f"Average Sentiment: {overall_sentiment:.1f} | Total Feedback Count: {total_feedback}")
         st.write("This provides the average sentiment as well as the total number of feedback collected")
+        if "model" in run:
+            st.caption(f"Processed at {run['processed_at']} with {run['model']}")
         st.markdown("---")
 
         # Section for the second row
         st.markdown("<h3><span style='border-bottom: 2px solid #FFF;'>AI Overall Summary of all feedback</span></h3>", unsafe_allow_html=True)
+        if run.get("summary_stale"):
+            st.warning("Some days in this range were reprocessed by a later overlapping run, so this summary may not match the feedback shown. Delete and process this range again to refresh it.")
         st.write(ai_summary)
         st.markdown("---")
 
@@ -208,21 +291,17 @@ elif selected_section == "Overview Report":
 # --- Visual Charts Page ---
 elif selected_section == "Visual Charts":
     st.header("Feedback Visualizations")
-    st.write("Select preprocessed data to view from the box below.")
+    st.write("Select preprocessed data, or a date range of the stored feedback, from the boxes below.")
     st.markdown("---")
 
-    # Load Preprocessed Data
-    preprocessed_files = [f for f in os.listdir("data/preprocessed") if f.endswith(".parquet")]
-    if preprocessed_files:
-      selected_file = st.selectbox("Select preprocessed data:", preprocessed_files)
-      if selected_file:
-        df = load_preprocessed_data(selected_file)
-    else:
-      df = pd.DataFrame()
-      st.warning("No preprocessed data available, please process the data in the Preprocess Data tab")
+    # Load the selected range (only its daily rollup, the feedback rows are not read)
+    aggregates = None
+    selected_range = select_feedback_range()
+    if selected_range:
+        aggregates = load_aggregates(*selected_range)
 
-    if not df.empty:
-        overall_sentiment, total_feedback, positive_feedback, negative_feedback, category_counts, segments, df_monthly = process_data(df)
+    if aggregates and aggregates[1]:
+        overall_sentiment, total_feedback, positive_feedback, negative_feedback, category_counts, segments, df_monthly = aggregates
     
         # Top metrics row
         col1, col2 = st.columns(2)
@@ -299,38 +378,60 @@ elif selected_section == "Visual Charts":
 # --- View Feedback Page ---
 elif selected_section == "View Feedback":
     st.header("View Feedback")
-    st.write("Select preprocessed data to view, and filter by category and sentiment.")
+    st.write("Select preprocessed data or a date range to view, filter by category and sentiment, and search the feedback text.")
     st.markdown("---")
 
-    # Load Preprocessed Data
-    preprocessed_files = [f for f in os.listdir("data/preprocessed") if f.endswith(".parquet")]
-    if preprocessed_files:
-      selected_file = st.selectbox("Select preprocessed data:", preprocessed_files)
-      if selected_file:
-        df = load_preprocessed_data(selected_file)
-    else:
-      df = pd.DataFrame()
-      st.warning("No preprocessed data available, please process the data in the Preprocess Data tab")
+    # Load the selected range, as an index that filters and pages without copying rows
+    index = None
+    selected_range = select_feedback_range()
+    if selected_range:
+        selected_label = run_label(*selected_range)
+        index = load_feedback_index(*selected_range)
     
-    if not df.empty:
+    if index is not None and len(index.df):
         # Filters
-        unique_categories = ["All"] + list(df["category"].unique())
-        selected_category = st.selectbox("Filter by Category", unique_categories)
-        unique_sentiments = ["All"] + list(df["sentiment"].unique())
-        selected_sentiment = st.selectbox("Filter by Sentiment", unique_sentiments)
+        col1, col2 = st.columns(2)
+        with col1:
+            selected_category = st.selectbox("Filter by Category", ["All"] + index.values("category"))
+        with col2:
+            selected_sentiment = st.selectbox("Filter by Sentiment", ["All"] + index.values("sentiment"))
+        search_query = st.text_input("Search feedback", placeholder="Words to find in the feedback text")
 
         # Apply filters
-        filtered_df = df.copy()
+        filters = {}
         if selected_category != "All":
-            filtered_df = filtered_df[filtered_df["category"] == selected_category]
+            filters["category"] = selected_category
         if selected_sentiment != "All":
-            filtered_df = filtered_df[filtered_df["sentiment"] == selected_sentiment]
-
-        # Display the filtered data
-        if not filtered_df.empty:
-           st.dataframe(filtered_df[["text", "timestamp", "category", "sentiment"]], hide_index = True)
+            filters["sentiment"] = selected_sentiment
+        rows = index.filter(filters, search_query)
+
+        # Display one page of the filtered data, so only the visible rows are sent to the browser
+        if len(rows):
+            col1, col2 = st.columns(2)
+            with col1:
+                page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1)
+            page_count = (len(rows) + page_size - 1) // page_size
+            with col2:
+                # Keyed by the filters, so a new filter starts again from the first page
+                page_number = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1,
+                                              key=f"feedback_page:{selected_label}:{selected_category}:{selected_sentiment}:{search_query}:{page_size}")
+            st.caption(f"{len(rows)} matching feedback entries, page {page_number} of {page_count}")
+            st.dataframe(index.page(rows, page_number, page_size)[["text", "timestamp", "category", "sentiment"]], hide_index = True)
         else:
             st.write("No feedback data found for the selected filters")
+
+        # CSV export of the whole range, only written when asked for. The file is kept until the next
+        # export in this session, so the download button survives the rerun its click triggers
+        export = st.session_state.get("csv_export")
+        if st.button("Prepare CSV Export"):
+            if export and os.path.exists(export["path"]):
+                os.remove(export["path"])
+            with st.spinner("Writing CSV..."):
+                export = {"label": selected_label, "path": prepare_csv_export(*selected_range)}
+            st.session_state.csv_export = export
+        if export and export["label"] == selected_label and os.path.exists(export["path"]):
+            with open(export["path"], "rb") as f:
+                st.download_button("Download CSV", f, file_name=f"{selected_label}.csv", mime="text/csv")
     else:
         st.warning("Please select a valid preprocessed data file.")
 
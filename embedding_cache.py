@@ -0,0 +1,123 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+EMBEDDING_CACHE_PATH = "data/cache/embeddings.sqlite3"
+MAX_DISK_ENTRIES = 200000  # roughly 600 MB of 768-dimension float32 vectors
+MAX_MEMORY_ENTRIES = 2000
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace so texts that only differ in spacing share a cache entry."""
+    return " ".join(text.split())
+
+def cache_key(model: str, text: str) -> str:
+    """Returns the content address of an embedding: a hash of the model name and normalized text."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-level embedding cache: a bounded in-process LRU in front of a size-limited SQLite store."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_disk_entries: int = MAX_DISK_ENTRIES, max_memory_entries: int = MAX_MEMORY_ENTRIES):
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        return self._conn
+
+    def _remember(self, key: str, embedding: List[float]):
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Looks up embeddings for texts, returning None for every text that is not cached."""
+        keys = [cache_key(model, text) for text in texts]
+        results = [None] * len(texts)
+        with self.lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    results[i] = self.memory[key]
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                conn = self._connection()
+                found = {}
+                missing_keys = list(missing)
+                for start in range(0, len(missing_keys), 500):
+                    batch = missing_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = conn.execute(f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", batch)
+                    for key, blob in rows:
+                        found[key] = array("f", blob).tolist()
+                if found:
+                    now = time.time()
+                    conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                    conn.commit()
+                for key, indices in missing.items():
+                    if key in found:
+                        self._remember(key, found[key])
+                        for i in indices:
+                            results[i] = found[key]
+                        self.disk_hits += len(indices)
+                    else:
+                        self.misses += len(indices)
+        return results
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[List[float]]):
+        """Stores embeddings for texts, evicting the least recently used entries past the size limit."""
+        now = time.time()
+        rows = []
+        with self.lock:
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                self._remember(key, embedding)
+                rows.append((key, array("f", embedding).tobytes(), now))
+            conn = self._connection()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)", rows)
+            count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_disk_entries:
+                # Evict down to 90% of the limit so eviction does not run on every insert
+                excess = count - int(self.max_disk_entries * 0.9)
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+            conn.commit()
+
+    def stats(self) -> Dict:
+        """Returns hit/miss counters for this process."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,91 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+from embedding_cache import normalize_text
+
+
+ENRICHMENT_CACHE_PATH = "data/cache/enrichments.sqlite3"
+
+
+def entry_key(text: str, timestamp: str) -> str:
+    """Returns the cache key of a feedback entry: a hash of its normalized text and timestamp."""
+    return hashlib.sha256(f"{normalize_text(text)}\0{timestamp}".encode("utf-8")).hexdigest()
+
+
+class EnrichmentCache:
+    """SQLite store of the sentiment and category given to each feedback entry.
+
+    Each label is stored with the version of what produced it (the sentiment scorer, or the
+    categorization model and prompt), and only counts as cached while that version is current.
+    """
+
+    def __init__(self, path: str = ENRICHMENT_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS enrichments ("
+                "key TEXT PRIMARY KEY, sentiment TEXT, sentiment_version TEXT, category TEXT, category_version TEXT, updated_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get_many(self, entries: List[Tuple[str, str]], sentiment_version: str, category_version: str) -> List[Dict]:
+        """Looks up (text, timestamp) entries, returning {"sentiment", "category"} for each, with None for labels not cached at the current version."""
+        keys = [entry_key(text, timestamp) for text, timestamp in entries]
+        found = {}
+        with self.lock:
+            conn = self._connection()
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, sentiment, sentiment_version, category, category_version FROM enrichments WHERE key IN ({placeholders})",
+                    batch,
+                )
+                for key, sentiment, stored_sentiment_version, category, stored_category_version in rows:
+                    found[key] = {
+                        "sentiment": sentiment if stored_sentiment_version == sentiment_version else None,
+                        "category": category if stored_category_version == category_version else None,
+                    }
+        results = [dict(found.get(key, {"sentiment": None, "category": None})) for key in keys]
+        complete = sum(1 for result in results if result["sentiment"] is not None and result["category"] is not None)
+        self.hits += complete
+        self.misses += len(results) - complete
+        return results
+
+    def put_sentiments(self, entries: List[Tuple[str, str]], sentiments: List[str], version: str):
+        """Stores the sentiment of each entry."""
+        self._put(entries, "sentiment", sentiments, version)
+
+    def put_categories(self, entries: List[Tuple[str, str]], categories: List[str], version: str):
+        """Stores the category of each entry."""
+        self._put(entries, "category", categories, version)
+
+    def _put(self, entries: List[Tuple[str, str]], column: str, values: List[str], version: str):
+        now = time.time()
+        rows = [(entry_key(text, timestamp), value, version, now) for (text, timestamp), value in zip(entries, values)]
+        with self.lock:
+            conn = self._connection()
+            conn.executemany(
+                f"INSERT INTO enrichments (key, {column}, {column}_version, updated_at) VALUES (?, ?, ?, ?) "
+                f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, {column}_version = excluded.{column}_version, updated_at = excluded.updated_at",
+                rows,
+            )
+            conn.commit()
+
+    def stats(self) -> Dict:
+        """Returns hit/miss counters for this process, counting an entry as a hit only if both labels were cached."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
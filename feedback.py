@@ -1,16 +1,14 @@
 import streamlit as st
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
 import re
 from typing import List
-from functions import count_tokens, sanitize_text, load_feedback_data, load_files_in_date_range
+from functions import sanitize_text, load_feedback_data
+from chat_log import transcript_lines
+from token_estimator import estimate_tokens
+from resources import get_generative_model
 from datetime import date, timedelta
 
 
-# Load environment variables
-load_dotenv(dotenv_path="config/.env")
-
 st.title("Policy Feedback Analysis Chatbot")
 
 # Sidebar with app explanation
@@ -38,9 +36,6 @@ if data_source == "Chat History":
     end_date = st.sidebar.date_input("End Date", date.today())
 
 
-# Configure Gemini API using key from .env
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
 # Generation config
 generation_config = {
     "temperature": 0.7,
@@ -52,10 +47,7 @@ generation_config = {
 
 # Initialize model and chat session in session state
 if "model" not in st.session_state:
-    st.session_state.model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash-exp",
-        generation_config=generation_config,
-    )
+    st.session_state.model = get_generative_model(generation_config)
 
 if "chat_session" not in st.session_state:
     st.session_state.chat_session = st.session_state.model.start_chat(history=[])
@@ -69,10 +61,7 @@ if "feedback_data" not in st.session_state or st.session_state.get("selected_opt
     st.session_state.selected_options = (data_source, start_date if data_source == "Chat History" else None, end_date if data_source == "Chat History" else None)
     all_feedback_data = []
     if data_source == "Chat History":
-        selected_files = load_files_in_date_range(start_date, end_date)
-        for selected_file in selected_files:
-            feedback_file_path = os.path.join("data", selected_file)
-            all_feedback_data.extend(load_feedback_data(feedback_file_path))
+        all_feedback_data = transcript_lines(start_date, end_date)
     elif data_source == "Policy Feedback":
        feedback_file_path = os.path.join("data", "policy_feedback.txt")
        all_feedback_data = load_feedback_data(feedback_file_path)
@@ -82,7 +71,7 @@ if "feedback_data" not in st.session_state or st.session_state.get("selected_opt
     if st.session_state.feedback_data:
       combined_text = "\n".join(st.session_state.feedback_data)
       char_count = len(combined_text)
-      approx_token_count = count_tokens(combined_text, st.session_state.model)
+      approx_token_count = estimate_tokens(combined_text)
       st.session_state.char_count = char_count
       st.session_state.approx_token_count = approx_token_count
     else:
@@ -163,8 +152,8 @@ if prompt := st.chat_input("Enter your query here"):
                  User's question: {prompt}
                   """
 
-            # Count input tokens using the enhanced prompt
-            input_tokens = count_tokens(enhanced_prompt, st.session_state.model)
+            # Estimate input tokens locally using the enhanced prompt
+            input_tokens = estimate_tokens(enhanced_prompt)
 
             # Generate Gemini response with context
             with st.chat_message("assistant"):
@@ -0,0 +1,196 @@
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List
+import google.generativeai as genai
+from rate_limit import TokenBucket, call_with_backoff
+
+
+FEEDBACK_CATEGORIES = ["Scheme Specific Feedback", "General Feedback", "Chatbot Feedback"]
+UNCATEGORIZED = "Uncategorized"
+
+# Scheduler settings
+MAX_CONCURRENT_BATCHES = 4
+REQUESTS_PER_MINUTE = 10  # the Gemini free tier limit for the flash models, raise it on a paid tier
+INITIAL_BATCH_SIZE = 10
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 100
+TARGET_BATCH_SECONDS = 15.0  # batches slower than this shrink, batches under half of it grow
+OUTPUT_TOKENS_PER_ITEM = 24  # output tokens one {"index", "category"} answer takes, with some margin
+OUTPUT_TOKEN_HEADROOM = 0.8  # share of max_output_tokens a batch's reply may be expected to use
+MAX_MISSING_SHARE = 0.25  # batches shrink when more than this share of items gets no valid answer
+MAX_ITEM_FAILURES = 3  # failed or unanswered attempts at an item before it is left uncategorized
+
+# Structured output: a list of {"index", "category"} objects, with the category limited to the known set
+CATEGORY_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            "category": {"type": "string", "format": "enum", "enum": FEEDBACK_CATEGORIES},
+        },
+        "required": ["index", "category"],
+    },
+}
+CATEGORY_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": CATEGORY_RESPONSE_SCHEMA}
+
+# Shared by every scheduler in the process, so concurrent runs stay under one limit together
+rate_limiter = TokenBucket(REQUESTS_PER_MINUTE)
+
+
+def request_categories(texts: List[str], model: genai.GenerativeModel) -> Dict[int, str]:
+    """Asks Gemini for the category of each feedback text, returning {item index: category} for the valid answers.
+
+    The reply is constrained to CATEGORY_RESPONSE_SCHEMA, and each answer names the index of the
+    item it is for, so answers cannot shift onto the wrong item. Answers with an unknown index or
+    category are dropped, and items without a valid answer are left out of the result. API errors
+    are raised.
+    """
+    numbered_texts = "\n".join([f"[{i}] {text}" for i, text in enumerate(texts)]) # Format a string for the prompt, each item on a new line with its index
+    classification_prompt = f"""You are a classification tool designed to categorize user feedback about government schemes into a category.
+
+        Instructions:
+        1. Analyze each user's feedback text below, and decide on a category for each of the user's feedback.
+        2. The categories are as follows:
+            "Scheme Specific Feedback"
+            "General Feedback"
+            "Chatbot Feedback"
+        3. Return the category that best fits each of the user's feedback.
+        4. Return one object per feedback, with "index" set to the number in square brackets before the feedback and "category" set to its category.
+
+        User's feedback:
+        {numbered_texts}
+        """
+    response = model.generate_content(classification_prompt, generation_config=CATEGORY_GENERATION_CONFIG)
+    return parse_categories(response.text, len(texts))
+
+def parse_categories(response_text: str, count: int) -> Dict[int, str]:
+    """Parses a categorization reply, keeping the first valid category given for each index below count."""
+    try:
+        answers = json.loads(response_text)
+    except ValueError:
+        return {}  # typically a reply cut off by the output token limit
+    categories = {}
+    for answer in answers if isinstance(answers, list) else []:
+        if not isinstance(answer, dict):
+            continue
+        index, category = answer.get("index"), answer.get("category")
+        if isinstance(index, int) and 0 <= index < count and category in FEEDBACK_CATEGORIES:
+            categories.setdefault(index, category)
+    return categories
+
+
+class CategorizationScheduler:
+    """Categorizes feedback in concurrent, rate-limited batches whose size adapts as the run goes.
+
+    Batches grow while replies come back quickly and shrink when they are slow, fail, or leave many
+    items without a valid answer. Batch size is also capped so a reply fits in the model's output token
+    limit. Rate limit and transient errors are retried with jittered backoff. A batch that still
+    fails is requeued in smaller batches. Items a reply missed or answered with an invalid category
+    are requeued on their own, so the rest of the batch is never paid for twice.
+    """
+
+    def __init__(self, model: genai.GenerativeModel, max_output_tokens: int, max_concurrent: int = MAX_CONCURRENT_BATCHES, initial_batch_size: int = INITIAL_BATCH_SIZE, limiter: TokenBucket = None):
+        self.model = model
+        self.max_concurrent = max_concurrent
+        self.max_batch_size = max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, int(max_output_tokens * OUTPUT_TOKEN_HEADROOM / OUTPUT_TOKENS_PER_ITEM)))
+        self.batch_size = max(MIN_BATCH_SIZE, min(initial_batch_size, self.max_batch_size))
+        self.limiter = limiter or rate_limiter
+        self.stats = {"batches": 0, "failed_batches": 0, "incomplete_batches": 0, "uncategorized": 0, "seconds": 0.0}
+
+    def _request(self, texts: List[str]):
+        self.limiter.acquire()
+        start_time = time.perf_counter()
+        categories = request_categories(texts, self.model)
+        return categories, time.perf_counter() - start_time
+
+    def _run_batch(self, texts: List[str]):
+        return call_with_backoff(self._request, texts)
+
+    def _adapt(self, seconds: float):
+        if seconds > TARGET_BATCH_SECONDS:
+            self.batch_size = max(MIN_BATCH_SIZE, int(self.batch_size * 0.75))
+        elif seconds < TARGET_BATCH_SECONDS / 2:
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 2))
+
+    def _shrink(self):
+        self.batch_size = max(MIN_BATCH_SIZE, self.batch_size // 2)
+
+    def categorize(self, texts: List[str], on_batch: Callable[[List[int], List[str]], None] = None) -> List[str]:
+        """Returns a category for each text, in order.
+
+        on_batch(indices, categories) is called on this thread as each batch completes, so
+        callers can store results as they arrive, and for items given up on as Uncategorized,
+        so every item is reported once.
+        """
+        start_time = time.perf_counter()
+        results = [None] * len(texts)
+        failures = {}
+        pending = deque(range(len(texts)))
+        followups = deque()
+
+        def retry_failed(indices: List[int]):
+            retry, given_up = [], []
+            for i in indices:
+                failures[i] = failures.get(i, 0) + 1
+                if failures[i] < MAX_ITEM_FAILURES:
+                    retry.append(i)
+                else:
+                    results[i] = UNCATEGORIZED
+                    given_up.append(i)
+                    self.stats["uncategorized"] += 1
+            if on_batch and given_up:
+                on_batch(given_up, [UNCATEGORIZED] * len(given_up))
+            # Retried ahead of new items, on their own, in batches of the (now smaller) batch size
+            for start in range(0, len(retry), self.batch_size):
+                followups.append(retry[start:start + self.batch_size])
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            in_flight = {}
+            while pending or followups or in_flight:
+                while (pending or followups) and len(in_flight) < self.max_concurrent:
+                    if followups:
+                        batch = followups.popleft()
+                    else:
+                        batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+                    in_flight[executor.submit(self._run_batch, [texts[i] for i in batch])] = batch
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    self.stats["batches"] += 1
+                    try:
+                        categories, seconds = future.result()
+                    except Exception as e:
+                        print(f"Error categorizing a batch of {len(batch)} feedback entries: {e}")
+                        self.stats["failed_batches"] += 1
+                        self._shrink()
+                        retry_failed(batch)
+                        continue
+
+                    completed = [i for position, i in enumerate(batch) if position in categories]
+                    for position, i in enumerate(batch):
+                        if position in categories:
+                            results[i] = categories[position]
+                    if on_batch and completed:
+                        on_batch(completed, [results[i] for i in completed])
+
+                    missing = [i for position, i in enumerate(batch) if position not in categories]
+                    if len(missing) > len(batch) * MAX_MISSING_SHARE:
+                        # Many unanswered items suggest a truncated or confused reply, so batches shrink
+                        self._shrink()
+                    else:
+                        self._adapt(seconds)
+                    if missing:
+                        # Only the items without a valid answer are sent again, in a follow-up batch
+                        self.stats["incomplete_batches"] += 1
+                        retry_failed(missing)
+
+        self.stats["seconds"] = time.perf_counter() - start_time
+        return results
+
+    def summary(self) -> Dict:
+        """Returns run statistics, including the batch size the run settled on."""
+        return {**self.stats, "batch_size": self.batch_size, "max_batch_size": self.max_batch_size}
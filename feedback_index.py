@@ -0,0 +1,79 @@
+import re
+from bisect import bisect_left
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+
+SEARCH_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+FILTER_COLUMNS = ["category", "sentiment"]
+PAGE_SIZES = [25, 50, 100, 200]  # rows per page offered by the View Feedback page
+
+
+class FeedbackIndex:
+    """Row indexes over a run's feedback for the View Feedback page.
+
+    Holds, for each category and sentiment value, the sorted positions of its rows, and an inverted
+    index from each word in the feedback text to the rows containing it. Filters and searches
+    intersect these arrays instead of scanning the rows, and only the requested page of rows is
+    ever materialized.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.assign(**{column: df[column].astype("category") for column in FILTER_COLUMNS})
+        self.rows_by_value = {}
+        for column in FILTER_COLUMNS:
+            codes = self.df[column].cat.codes.to_numpy()
+            order = np.argsort(codes, kind="stable").astype(np.int64)
+            bounds = np.searchsorted(codes[order], np.arange(len(self.df[column].cat.categories) + 1))
+            self.rows_by_value[column] = {
+                str(value): order[bounds[i]:bounds[i + 1]]
+                for i, value in enumerate(self.df[column].cat.categories)
+                if bounds[i + 1] > bounds[i]
+            }
+
+        postings = {}
+        for row, text in enumerate(self.df["text"].tolist()):
+            for token in set(SEARCH_TOKEN_PATTERN.findall(str(text).lower())):
+                postings.setdefault(token, []).append(row)
+        self.vocabulary = sorted(postings)
+        self.postings = {token: np.array(rows, dtype=np.int64) for token, rows in postings.items()}
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory use, for the dashboard's frame cache."""
+        arrays = [rows for values in self.rows_by_value.values() for rows in values.values()] + list(self.postings.values())
+        return int(self.df.memory_usage(deep=True).sum()) + sum(rows.nbytes for rows in arrays) + sum(len(token) + 50 for token in self.vocabulary)
+
+    def values(self, column: str) -> List[str]:
+        return list(self.rows_by_value[column])
+
+    def search(self, query: str) -> np.ndarray:
+        """Returns the rows whose text has every word of the query, the last word also matching as a prefix."""
+        words = SEARCH_TOKEN_PATTERN.findall(query.lower())
+        rows = None
+        for i, word in enumerate(words):
+            if i == len(words) - 1:
+                # Words starting with the last query word, so results update while it is being typed
+                start = bisect_left(self.vocabulary, word)
+                end = start
+                while end < len(self.vocabulary) and self.vocabulary[end].startswith(word):
+                    end += 1
+                matches = [self.postings[token] for token in self.vocabulary[start:end]]
+                word_rows = np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+            else:
+                word_rows = self.postings.get(word, np.empty(0, dtype=np.int64))
+            rows = word_rows if rows is None else np.intersect1d(rows, word_rows, assume_unique=True)
+        return np.arange(len(self.df)) if rows is None else rows
+
+    def filter(self, filters: Dict[str, str] = None, query: str = "") -> np.ndarray:
+        """Returns the sorted positions of the rows matching every {column: value} filter and the search query."""
+        rows = self.search(query) if query.strip() else np.arange(len(self.df))
+        for column, value in (filters or {}).items():
+            rows = np.intersect1d(rows, self.rows_by_value[column].get(value, np.empty(0, dtype=np.int64)), assume_unique=True)
+        return rows
+
+    def page(self, rows: np.ndarray, page_number: int, page_size: int) -> pd.DataFrame:
+        """Returns the rows of one page (numbered from 1) of a filter result."""
+        start = (page_number - 1) * page_size
+        return self.df.iloc[rows[start:start + page_size]]
@@ -0,0 +1,337 @@
+import os
+import json
+import shutil
+from datetime import date, datetime, timedelta
+from typing import BinaryIO, Dict, List, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sentiment import get_scorer
+
+
+PREPROCESSED_DIR = "data/preprocessed"
+# Enriched feedback, one hive-style partition per day: feedback/date=YYYY-MM-DD/part-0.parquet
+FEEDBACK_STORE_PATH = os.path.join(PREPROCESSED_DIR, "feedback")
+# Metadata of each "Process Data" run: date range, AI summary, feedback counts, model and prompt versions
+RUNS_PATH = os.path.join(PREPROCESSED_DIR, "runs.json")
+# Feedback counts and polarity sums per day, sentiment and category, read by the dashboard's charts
+ROLLUP_PATH = os.path.join(PREPROCESSED_DIR, "daily_rollup.parquet")
+
+FEEDBACK_SCHEMA = pa.schema([
+    ("text", pa.string()),
+    ("timestamp", pa.timestamp("s")),
+    ("sentiment", pa.dictionary(pa.int8(), pa.string())),
+    ("category", pa.dictionary(pa.int8(), pa.string())),
+])
+ROLLUP_SCHEMA = pa.schema([
+    ("date", pa.string()),
+    ("sentiment", pa.string()),
+    ("category", pa.string()),
+    ("count", pa.int64()),
+    ("polarity_sum", pa.float64()),
+])
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+# The Parquet files are the only copy of the enriched feedback, CSV is exported from them on demand
+PARQUET_COMPRESSION = "zstd"
+CSV_CHUNK_ROWS = 10000
+
+
+def run_label(start_date: date, end_date: date) -> str:
+    """Returns the display name of a date range, e.g. "Jan 14, 2025 - Jan 21, 2025"."""
+    return f"{start_date.strftime('%b %d, %Y')} - {end_date.strftime('%b %d, %Y')}"
+
+# ---------- Enriched Feedback ----------
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """Converts enriched feedback rows to an Arrow table with typed timestamps and dictionary-encoded labels."""
+    df = df[["text", "timestamp", "sentiment", "category"]].copy()
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    df["sentiment"] = df["sentiment"].astype("category")
+    df["category"] = df["category"].astype("category")
+    table = pa.Table.from_pandas(df, schema=FEEDBACK_SCHEMA, preserve_index=False)
+    return table.append_column("date", pa.array(df["timestamp"].dt.strftime("%Y-%m-%d"), pa.string()))
+
+def write_feedback(df: pd.DataFrame, start_date: date, end_date: date, store_path: str = FEEDBACK_STORE_PATH):
+    """Writes enriched feedback for a date range, replacing the stored partitions of every day in the range.
+
+    The new partitions are written to a staging directory first and only then moved into place, so
+    a failed write leaves the stored days and the rollup as they were.
+    """
+    staging_path = f"{store_path}.staging"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    if not df.empty:
+        ds.write_dataset(
+            to_table(df),
+            staging_path,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template="part-{i}.parquet",
+            file_options=ds.ParquetFileFormat().make_write_options(compression=PARQUET_COMPRESSION, use_dictionary=True),
+        )
+    staged = set(os.listdir(staging_path)) if os.path.isdir(staging_path) else set()
+    day = start_date
+    while day <= end_date:
+        # Days in the range with no feedback left must not keep stale rows either
+        staged.add(f"date={day.isoformat()}")
+        day += timedelta(days=1)
+    os.makedirs(store_path, exist_ok=True)
+    for partition in sorted(staged):
+        shutil.rmtree(os.path.join(store_path, partition), ignore_errors=True)
+        if os.path.isdir(os.path.join(staging_path, partition)):
+            os.replace(os.path.join(staging_path, partition), os.path.join(store_path, partition))
+    shutil.rmtree(staging_path, ignore_errors=True)
+    update_rollup(df, start_date, end_date)
+
+def feedback_dataset(store_path: str = FEEDBACK_STORE_PATH) -> ds.Dataset:
+    return ds.dataset(store_path, format="parquet", partitioning=PARTITIONING)
+
+def read_feedback_range(start_date: date, end_date: date, columns: List[str] = None, store_path: str = FEEDBACK_STORE_PATH) -> pd.DataFrame:
+    """Reads the enriched feedback between two dates (inclusive).
+
+    The date filter is applied to the partition paths, so only the files of days in the range are opened.
+    """
+    columns = columns or ["text", "timestamp", "sentiment", "category"]
+    if not os.path.isdir(store_path):
+        return pd.DataFrame(columns=columns)
+    date_filter = (ds.field("date") >= start_date.isoformat()) & (ds.field("date") <= end_date.isoformat())
+    df = feedback_dataset(store_path).to_table(columns=columns, filter=date_filter).to_pandas()
+    if "timestamp" in columns:
+        df = df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+    return df
+
+def write_csv(start_date: date, end_date: date, f: BinaryIO, chunk_rows: int = CSV_CHUNK_ROWS, store_path: str = FEEDBACK_STORE_PATH):
+    """Writes the enriched feedback between two dates to a binary file as CSV, one batch of rows at a time.
+
+    Days are read and written one at a time, in time order, so memory use stays at one day's rows
+    however large the range is.
+    """
+    columns = ["text", "timestamp", "sentiment", "category"]
+    header = True
+    for day in stored_dates(store_path):
+        if start_date <= day <= end_date:
+            partition = ds.dataset(os.path.join(store_path, f"date={day.isoformat()}"), format="parquet")
+            for batch in partition.to_table(columns=columns).sort_by("timestamp").to_batches(max_chunksize=chunk_rows):
+                if batch.num_rows:
+                    f.write(batch.to_pandas().to_csv(index=False, header=header).encode("utf-8"))
+                    header = False
+    if header:
+        f.write(pd.DataFrame(columns=columns).to_csv(index=False).encode("utf-8"))
+
+def stored_dates(store_path: str = FEEDBACK_STORE_PATH) -> List[date]:
+    """Returns the days that have a stored partition."""
+    if not os.path.isdir(store_path):
+        return []
+    return sorted(date.fromisoformat(name[len("date="):]) for name in os.listdir(store_path) if name.startswith("date="))
+
+# ---------- Daily Rollup ----------
+
+def compute_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the feedback count and polarity sum of each day, sentiment and category in enriched feedback."""
+    if df.empty:
+        return pd.DataFrame({field.name: pd.Series(dtype=field.type.to_pandas_dtype()) for field in ROLLUP_SCHEMA})
+    rows = pd.DataFrame({
+        "date": pd.to_datetime(df["timestamp"]).dt.strftime("%Y-%m-%d"),
+        "sentiment": df["sentiment"].astype(str),
+        "category": df["category"].astype(str),
+        "polarity": get_scorer().polarities(df["text"].tolist()),
+    })
+    rollup = rows.groupby(["date", "sentiment", "category"], sort=True).agg(count=("polarity", "size"), polarity_sum=("polarity", "sum"))
+    return rollup.reset_index()
+
+def load_rollup(rollup_path: str = ROLLUP_PATH) -> pd.DataFrame:
+    """Returns the whole rollup table, building it from the stored feedback the first time."""
+    if not os.path.exists(rollup_path):
+        if not stored_dates():
+            return compute_rollup(pd.DataFrame())
+        rebuild_rollup(rollup_path)
+    return pq.read_table(rollup_path).to_pandas()
+
+def save_rollup(rollup: pd.DataFrame, rollup_path: str = ROLLUP_PATH):
+    os.makedirs(os.path.dirname(rollup_path), exist_ok=True)
+    table = pa.Table.from_pandas(rollup.sort_values(["date", "sentiment", "category"]), schema=ROLLUP_SCHEMA, preserve_index=False)
+    tmp_path = f"{rollup_path}.tmp"
+    pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION, use_dictionary=True)
+    os.replace(tmp_path, rollup_path)
+
+def update_rollup(df: pd.DataFrame, start_date: date, end_date: date, rollup_path: str = ROLLUP_PATH):
+    """Replaces the rollup rows of the days in a range with those of df, leaving every other day as it is."""
+    rollup = load_rollup(rollup_path)
+    kept = rollup[(rollup["date"] < start_date.isoformat()) | (rollup["date"] > end_date.isoformat())]
+    save_rollup(pd.concat([kept, compute_rollup(df)], ignore_index=True), rollup_path)
+
+def remove_rollup_days(days: List[date], rollup_path: str = ROLLUP_PATH):
+    if not days or not os.path.exists(rollup_path):
+        return
+    rollup = load_rollup(rollup_path)
+    save_rollup(rollup[~rollup["date"].isin([day.isoformat() for day in days])], rollup_path)
+
+def rebuild_rollup(rollup_path: str = ROLLUP_PATH):
+    """Builds the rollup table from a full scan of the stored feedback, for stores written before it existed."""
+    df = feedback_dataset().to_table(columns=["text", "timestamp", "sentiment", "category"]).to_pandas()
+    save_rollup(compute_rollup(df), rollup_path)
+
+def read_rollup(start_date: date, end_date: date, rollup_path: str = ROLLUP_PATH) -> pd.DataFrame:
+    """Returns the rollup rows of the days between two dates (inclusive)."""
+    rollup = load_rollup(rollup_path)
+    in_range = (rollup["date"] >= start_date.isoformat()) & (rollup["date"] <= end_date.isoformat())
+    return rollup[in_range].reset_index(drop=True)
+
+# ---------- File Signatures ----------
+
+def range_signature(start_date: date, end_date: date, store_path: str = FEEDBACK_STORE_PATH) -> tuple:
+    """Returns (path, mtime, size) of every stored file for the days in a range, to key cached reads by."""
+    signature = []
+    day = start_date
+    while day <= end_date:
+        partition = os.path.join(store_path, f"date={day.isoformat()}")
+        if os.path.isdir(partition):
+            for entry in sorted(os.scandir(partition), key=lambda entry: entry.name):
+                stat = entry.stat()
+                signature.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        day += timedelta(days=1)
+    return tuple(signature)
+
+def file_signature(path: str) -> tuple:
+    """Returns (path, mtime, size) of a file, or just the path if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path,)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+# ---------- Runs ----------
+
+def load_runs(runs_path: str = RUNS_PATH) -> List[Dict]:
+    """Returns the recorded preprocessing runs, newest first."""
+    if not os.path.exists(runs_path):
+        return []
+    with open(runs_path, "r", encoding="utf-8") as f:
+        runs = json.load(f)
+    return sorted(runs, key=lambda run: run["processed_at"], reverse=True)
+
+def save_runs(runs: List[Dict], runs_path: str = RUNS_PATH):
+    os.makedirs(os.path.dirname(runs_path), exist_ok=True)
+    tmp_path = f"{runs_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(runs, f, indent=2)
+    os.replace(tmp_path, runs_path)
+
+def find_run(runs: List[Dict], label: str) -> Dict:
+    return next((run for run in runs if run["label"] == label), None)
+
+COUNT_KEYS = ("row_count", "sentiment_counts", "category_counts")
+
+def feedback_counts(df: pd.DataFrame) -> Dict:
+    """Returns the row, sentiment and category counts of enriched feedback, as kept in run metadata."""
+    return {
+        "row_count": int(len(df)),
+        "sentiment_counts": {str(value): int(count) for value, count in df["sentiment"].value_counts().items() if count},
+        "category_counts": {str(value): int(count) for value, count in df["category"].value_counts().items() if count},
+    }
+
+def record_run(start_date: date, end_date: date, ai_summary: str, metadata: Dict = None, runs_path: str = RUNS_PATH) -> Dict:
+    """Records a run for a date range, replacing any earlier run of the same range.
+
+    metadata holds the feedback counts and the model and prompt versions of the run, so pages that
+    only show the summary and totals never have to read the feedback rows. Other runs whose range
+    overlaps this one share the rewritten days, so their counts are dropped for ensure_run_counts
+    to recompute, and their summaries are marked stale.
+    """
+    label = run_label(start_date, end_date)
+    runs = [run for run in load_runs(runs_path) if run["label"] != label]
+    for other in runs:
+        if other["start_date"] <= end_date.isoformat() and other["end_date"] >= start_date.isoformat():
+            for key in COUNT_KEYS:
+                other.pop(key, None)
+            other["summary_stale"] = True
+    run = {
+        "label": label,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "ai_summary": ai_summary,
+        "processed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        **(metadata or {}),
+    }
+    runs.append(run)
+    save_runs(runs, runs_path)
+    return run
+
+def ensure_run_counts(run: Dict, runs_path: str = RUNS_PATH) -> Dict:
+    """Adds feedback counts to a run recorded without them, reading only its label columns once."""
+    if "row_count" in run:
+        return run
+    run.update(feedback_counts(read_run(run, columns=["sentiment", "category"])))
+    runs = load_runs(runs_path)
+    for stored in runs:
+        if stored["label"] == run["label"]:
+            stored.update(run)
+    save_runs(runs, runs_path)
+    return run
+
+def run_metrics(run: Dict) -> Tuple[float, int, int, int]:
+    """Returns a run's average sentiment (-1 to 1), total, positive and negative feedback counts from its metadata."""
+    counts = run["sentiment_counts"]
+    total = run["row_count"]
+    positive = counts.get("positive", 0)
+    negative = counts.get("negative", 0)
+    return ((positive - negative) / total if total else 0.0), total, positive, negative
+
+def delete_run(label: str, runs_path: str = RUNS_PATH, store_path: str = FEEDBACK_STORE_PATH):
+    """Deletes a run, and the stored days no other run covers."""
+    runs = load_runs(runs_path)
+    run = find_run(runs, label)
+    if run is None:
+        raise FileNotFoundError(label)
+    remaining = [other for other in runs if other["label"] != label]
+    covered = set()
+    for other in remaining:
+        day = date.fromisoformat(other["start_date"])
+        while day <= date.fromisoformat(other["end_date"]):
+            covered.add(day)
+            day += timedelta(days=1)
+    removed = []
+    day = date.fromisoformat(run["start_date"])
+    while day <= date.fromisoformat(run["end_date"]):
+        if day not in covered:
+            shutil.rmtree(os.path.join(store_path, f"date={day.isoformat()}"), ignore_errors=True)
+            removed.append(day)
+        day += timedelta(days=1)
+    remove_rollup_days(removed)
+    save_runs(remaining, runs_path)
+
+def run_signature(run: Dict) -> tuple:
+    """Returns the signature of the stored files a run's rows are read from."""
+    return range_signature(date.fromisoformat(run["start_date"]), date.fromisoformat(run["end_date"]))
+
+def read_run(run: Dict, columns: List[str] = None) -> pd.DataFrame:
+    """Reads the enriched feedback of a run's date range."""
+    return read_feedback_range(date.fromisoformat(run["start_date"]), date.fromisoformat(run["end_date"]), columns)
+
+# ---------- Migration ----------
+
+def migrate_range_files(preprocessed_dir: str = PREPROCESSED_DIR):
+    """Imports the old per-range "<start> - <end>.parquet" files into the partitioned store and records them as runs.
+
+    Ranges are imported in order of their end date, so where ranges overlap the later one wins.
+    Files whose range is already recorded as a run are skipped, the old files are left in place.
+    """
+    if not os.path.isdir(preprocessed_dir):
+        return
+    recorded = {run["label"] for run in load_runs()}
+    legacy = []
+    for filename in os.listdir(preprocessed_dir):
+        if filename.endswith(".parquet") and " - " in filename and filename[:-len(".parquet")] not in recorded:
+            start, end = filename[:-len(".parquet")].split(" - ")
+            legacy.append((datetime.strptime(start, "%b %d, %Y").date(), datetime.strptime(end, "%b %d, %Y").date(), filename))
+    legacy.sort(key=lambda item: (item[1], item[0]))
+    for start_date, end_date, filename in legacy:
+        df = pd.read_parquet(os.path.join(preprocessed_dir, filename))
+        write_feedback(df, start_date, end_date)
+        # Counts are left to ensure_run_counts, since a later overlapping range may replace some of these rows
+        record_run(start_date, end_date, df["ai_summary"].iloc[0] if "ai_summary" in df.columns and len(df) else "")
+        print(f"Imported {len(df)} rows from {filename}")
+
+
+if __name__ == "__main__":
+    migrate_range_files()
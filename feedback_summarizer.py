@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import pandas as pd
+import google.generativeai as genai
+from rate_limit import call_with_backoff
+from token_estimator import estimate_tokens
+from feedback_categorizer import rate_limiter
+
+
+SUMMARY_CACHE_PATH = "data/cache/summaries.sqlite3"
+SUMMARY_PROMPT_VERSION = "summary-v1"  # bump when the prompts below change
+
+MAX_CONCURRENT_SUMMARIES = 4
+MAP_INPUT_TOKENS = 30000  # feedback text per map call, larger day/category groups are split
+REDUCE_INPUT_TOKENS = 30000  # partial summaries per reduce call, more are reduced in levels
+PARTIAL_SUMMARY_WORDS = 150
+
+
+def content_key(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """SQLite store of partial and range summaries, keyed by a hash of what was summarized and how."""
+
+    def __init__(self, path: str = SUMMARY_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, label TEXT NOT NULL, summary TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key: str):
+        with self.lock:
+            row = self._connection().execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, label: str, summary: str):
+        with self.lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO summaries (key, label, summary, created_at) VALUES (?, ?, ?, ?)", (key, label, summary, time.time()))
+            conn.commit()
+
+
+class FeedbackSummarizer:
+    """Summarizes a date range of feedback by map-reduce.
+
+    Map: each day and category is summarized on its own, concurrently, and cached under a hash of
+    its feedback, so a later range that shares days reuses those summaries and only new or changed
+    days cost API calls. Reduce: the partial summaries are combined into the range summary, in
+    several levels when there are too many for one prompt.
+    """
+
+    def __init__(self, model: genai.GenerativeModel, cache: SummaryCache = None, max_concurrent: int = MAX_CONCURRENT_SUMMARIES):
+        self.model = model
+        self.cache = cache or SummaryCache()
+        self.max_concurrent = max_concurrent
+        self.version = f"{model.model_name}:{SUMMARY_PROMPT_VERSION}"
+        self.stats = {"partials": 0, "partials_cached": 0, "calls": 0}
+        self.lock = threading.Lock()
+
+    def _generate(self, prompt: str) -> str:
+        rate_limiter.acquire()
+        with self.lock:
+            self.stats["calls"] += 1
+        return call_with_backoff(self.model.generate_content, prompt).text.strip()
+
+    def _cached(self, key: str, label: str, prompt_builder) -> str:
+        summary = self.cache.get(key)
+        if summary is None:
+            summary = self._generate(prompt_builder())
+            self.cache.put(key, label, summary)
+        return summary
+
+    # ---------- Map ----------
+
+    def groups(self, df: pd.DataFrame) -> List[Tuple[str, str, List[str]]]:
+        """Splits feedback into (day, category, texts) groups, with texts in time order."""
+        df = df.assign(day=pd.to_datetime(df["timestamp"]).dt.strftime("%Y-%m-%d")).sort_values("timestamp", kind="stable")
+        return [(day, str(category), group["text"].tolist()) for (day, category), group in df.groupby(["day", "category"], sort=True, observed=True)]
+
+    def summarize_group(self, day: str, category: str, texts: List[str]) -> str:
+        """Returns the summary of one day and category, splitting it first if it is too long for one call."""
+        key = content_key(self.version, "map", day, category, *texts)
+        if self.cache.get(key) is not None:
+            with self.lock:
+                self.stats["partials_cached"] += 1
+        label = f"{day} / {category}"
+
+        def build_prompt(part: List[str]) -> str:
+            combined_texts = "\n".join([f"- {text}" for text in part])
+            return f"""You are a helpful assistant that summarizes feedback for users.
+         Instructions:
+          1. Summarise the feedback below about government schemes, given on {day} and categorised as "{category}".
+          2. Keep the specific schemes, concerns and suggestions mentioned, and roughly how many users raised each.
+          3. Return ONLY the summary, in at most {PARTIAL_SUMMARY_WORDS} words.
+
+        User Feedback:
+          {combined_texts}
+         """
+
+        parts = split_by_tokens(texts, MAP_INPUT_TOKENS)
+        if len(parts) == 1:
+            return self._cached(key, label, lambda: build_prompt(texts))
+        part_summaries = [
+            self._cached(content_key(self.version, "map", day, category, *part), f"{label} part {i + 1}", lambda part=part: build_prompt(part))
+            for i, part in enumerate(parts)
+        ]
+        return self._cached(key, label, lambda: combine_prompt(part_summaries))
+
+    # ---------- Reduce ----------
+
+    def reduce(self, labelled: List[Tuple[str, str]]) -> str:
+        """Combines (label, summary) partials into the final summary, in levels if they do not fit in one prompt."""
+        while True:
+            levels = split_by_tokens([f"[{label}]\n{summary}" for label, summary in labelled], REDUCE_INPUT_TOKENS)
+            if len(levels) == 1:
+                break
+            with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+                combined = list(executor.map(lambda part: self._cached(content_key(self.version, "reduce", *part), "intermediate", lambda: combine_prompt(part)), levels))
+            labelled = [(f"part {i + 1}", summary) for i, summary in enumerate(combined)]
+
+        partials = "\n\n".join(f"[{label}]\n{summary}" for label, summary in labelled)
+        prompt = f"""You are a helpful assistant that summarizes feedback for users.
+         Instructions:
+          1. Use the summaries of user feedback below, each for one day and category, to create a useful summarisation of feedback about government schemes.
+          2. Provide an overall summary of the general feedback, as well as specific points about the different types of feedback.
+
+        Feedback Summaries:
+          {partials}
+         """
+        return self._cached(content_key(self.version, "reduce", partials), "range", lambda: prompt)
+
+    def summarize(self, df: pd.DataFrame) -> str:
+        """Returns the summary of every feedback entry in df."""
+        groups = self.groups(df)
+        self.stats["partials"] = len(groups)
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            partials = list(executor.map(lambda group: self.summarize_group(*group), groups))
+        return self.reduce([(f"{day} / {category}", summary) for (day, category, _), summary in zip(groups, partials)])
+
+
+def split_by_tokens(texts: List[str], max_tokens: int) -> List[List[str]]:
+    """Splits texts, in order, into consecutive parts of at most max_tokens estimated tokens (a longer single text gets its own part)."""
+    parts = [[]]
+    tokens = 0
+    for text in texts:
+        text_tokens = estimate_tokens(text)
+        if parts[-1] and tokens + text_tokens > max_tokens:
+            parts.append([])
+            tokens = 0
+        parts[-1].append(text)
+        tokens += text_tokens
+    return parts
+
+def combine_prompt(summaries: List[str]) -> str:
+    combined = "\n\n".join(summaries)
+    return f"""You are a helpful assistant that summarizes feedback for users.
+         Instructions:
+          1. Combine the partial summaries of user feedback about government schemes below into one summary.
+          2. Keep the specific schemes, concerns and suggestions mentioned, and roughly how many users raised each.
+          3. Return ONLY the combined summary, in at most {PARTIAL_SUMMARY_WORDS * 2} words.
+
+        Partial Summaries:
+          {combined}
+         """
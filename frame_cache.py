@@ -0,0 +1,72 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+import pandas as pd
+
+
+MAX_CACHED_BYTES = 512 * 1024 * 1024  # decoded frames and aggregates kept in memory by the dashboard
+
+
+def estimated_size(value) -> int:
+    """Estimates the memory used by a cached value, counting DataFrames and Series by their data."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimated_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimated_size(key) + estimated_size(item) for key, item in value.items())
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)  # NumPy arrays, and indexes that report their own size
+    return sys.getsizeof(value)
+
+
+class FrameCache:
+    """In-process LRU of loaded frames and computed aggregates, bounded by their estimated memory use.
+
+    Keys include a signature of the files a value was computed from (paths, modification times and
+    sizes), so a rewritten file changes the key and stale values simply age out. Cached values are
+    shared, callers must not modify them.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHED_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key: (value, size)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable):
+        """Returns the cached value for key, computing and caching it on a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        size = estimated_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.total_bytes += size
+                while self.total_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted_size
+        return value
+
+    def stats(self) -> Dict:
+        """Returns hit/miss counters and the memory in use."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
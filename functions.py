@@ -1,21 +1,22 @@
-import os
 import google.generativeai as genai
 import re
 from typing import List
-from datetime import date, datetime
+from datetime import datetime
 import streamlit as st
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
-from textblob import TextBlob
-from dotenv import load_dotenv
 import pandas as pd
+from embedding_cache import EmbeddingCache
+from enrichment_cache import EnrichmentCache
+from feedback_categorizer import CategorizationScheduler, FEEDBACK_CATEGORIES
+from sentiment import get_scorer as get_sentiment_scorer
+from feedback_summarizer import FeedbackSummarizer, SUMMARY_PROMPT_VERSION
+from resources import configure_gemini, get_generative_model
+from chat_log import TIMESTAMP_FORMAT, make_event, get_writer as get_chat_log_writer, read_feedback
 
 
-# Load environment variables
-load_dotenv(dotenv_path="config/.env")
-
 # Configure Gemini API using key from .env
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+configure_gemini()
 
 # Generation config
 generation_config = {
@@ -26,11 +27,8 @@ generation_config = {
     "response_mime_type": "text/plain",
 }
 
-# Initialize model
-model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash-exp",
-    generation_config=generation_config,
-)
+# Initialize model (shared with the other pages through the resource cache)
+model = get_generative_model(generation_config)
 
 # ---------- Text Processing Functions ----------
 
@@ -47,11 +45,14 @@ def clean_text(text: str) -> str:
 
     return text
 
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 400
+
 def chunk_text(text: str) -> List[str]:
     """Split text into chunks"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000,
-        chunk_overlap=400,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
     return text_splitter.split_text(text)
@@ -61,84 +62,93 @@ def sanitize_text(text):
     # Escape single dollar signs that are not part of LaTeX expressions, preserving spacing
     text = re.sub(r'(?<!\$)(?<!\\)\$(?!\$)', r'\$', text)
     return text
+
+class StreamSanitizer:
+    """Applies sanitize_text incrementally to streamed chunks.
+
+    Whether a dollar sign is escaped depends on the characters on either side of it, so a
+    trailing dollar sign is held back until the next chunk (or the end of the stream) shows
+    what follows it.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.emitted = 0  # number of raw characters already sanitized and returned
+
+    def _sanitize_until(self, end: int) -> str:
+        out = []
+        for i in range(self.emitted, end):
+            char = self.raw[i]
+            if char == "$":
+                prev_char = self.raw[i - 1] if i > 0 else ""
+                next_char = self.raw[i + 1] if i + 1 < len(self.raw) else ""
+                if prev_char not in ("$", "\\") and next_char != "$":
+                    char = "\\$"
+            out.append(char)
+        self.emitted = end
+        return "".join(out)
+
+    def feed(self, chunk: str) -> str:
+        """Adds a chunk of raw text and returns the sanitized text that is safe to display so far."""
+        self.raw += chunk
+        end = len(self.raw)
+        if self.raw.endswith("$"):
+            end -= 1
+        return self._sanitize_until(end)
+
+    def flush(self) -> str:
+        """Returns any held back text once the stream has finished."""
+        return self._sanitize_until(len(self.raw))
   
 # ---------- Embedding and Token Functions ----------
 
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Embeddings are cached on disk, so repeated texts never hit the API twice
+embedding_cache = EmbeddingCache()
+
 def create_embedding(text: str) -> List[float]:
     """Create embedding for a single piece of text"""
-    result = genai.embed_content(
-        model="models/text-embedding-004",
-        content=text
-    )
-    return result['embedding']
+    return create_embeddings([text])[0]
+
+def create_embeddings(texts: List[str]) -> List[List[float]]:
+    """Create embeddings for a batch of texts, requesting only the uncached ones in a single API call"""
+    texts = list(texts)
+    embeddings = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        result = genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=[texts[i] for i in missing]
+        )
+        new_embeddings = result['embedding']
+        embedding_cache.put_many(EMBEDDING_MODEL, [texts[i] for i in missing], new_embeddings)
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+    return embeddings
 
-def count_tokens(text: str, model: genai.GenerativeModel) -> int:
-    """Counts tokens in a given text using the model's tokenizer."""
-    try:
-        response = model.count_tokens(text)
-        return response.total_tokens
-    except Exception as e:
-      st.error(f"Error counting tokens: {e}")
-      return 0
-    
 # ---------- Chat History Functions ----------
 
-def save_chat_history(user_message: str, assistant_message: str, new_session: bool, category: str = None, previous_assistant_message: str = None):
-    """Saves the current user question and LLM reply to a file named with today's date, grouped by session and category."""
-    
-    history_dir = "data/chatHistory"
-    os.makedirs(history_dir, exist_ok=True)
+def save_chat_history(user_message: str, assistant_message: str, category: str = None, session_id: str = None) -> bool:
+    """Appends the current user question and LLM reply to the chat event log. Returns whether the save succeeded.
 
-    normal_chat_dir = os.path.join(history_dir, "normalchat")
-    os.makedirs(normal_chat_dir, exist_ok=True)
-    
-    feedback_dir = os.path.join(history_dir, "feedback")
-    os.makedirs(feedback_dir, exist_ok=True)
-    
-    pure_feedback_dir = os.path.join(history_dir, "purefeedback")
-    os.makedirs(pure_feedback_dir, exist_ok=True)
-    
-    today = date.today().strftime("%Y-%m-%d")
-    
-    original_file_path = os.path.join(history_dir, f"{today}.txt")
-    normal_chat_file_path = os.path.join(normal_chat_dir, f"normalchat_{today}.txt")
-    feedback_file_path = os.path.join(feedback_dir, f"feedback_{today}.txt")
-    pure_feedback_file_path = os.path.join(pure_feedback_dir, f"purefeedback_{today}.txt")
-    
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    try:
-        # Save the original chat history (user + assistant)
-        with open(original_file_path, "a", encoding="utf-8") as f:
-            if new_session:
-                f.write(f"Session started at: {now}\n")
-                f.write("-" * 40 + "\n\n")
-            f.write(f"user: {user_message}\t{now}\n\n")
-            f.write(f"assistant: {assistant_message}\n\n")
-            f.write("-" * 40 + "\n\n")  # Add a separator between turns
-
-        # Save user message to categorized file
-        if category == "normalchat":
-            with open(normal_chat_file_path, "a", encoding="utf-8") as f:
-                f.write(f"user: {user_message}\t{now}\n\n")
-        elif category == "feedback":
-            with open(feedback_file_path, "a", encoding="utf-8") as f:
-                if previous_assistant_message:
-                    f.write(f"assistant: {previous_assistant_message}\n\n")
-                f.write(f"user: {user_message}\t{now}\n\n")
-            # Save pure feedback user message
-            with open(pure_feedback_file_path, "a", encoding="utf-8") as f:
-              f.write(f"user: {user_message}\t{now}\n\n")
-              
-        print(f"Chat history saved to: {original_file_path}")
-        if category:
-          print(f"Chat history saved to categorized file: {normal_chat_file_path if category == 'normalchat' else feedback_file_path if category == 'feedback' else None}")
-          if category == 'feedback':
-             print(f"Chat history saved to pure feedback file: {pure_feedback_file_path}")
+    Writes are buffered and flushed by a background thread, see chat_log.py. The legacy per-day text
+    files can be regenerated from the log with "python chat_log.py export".
+    """
+    now = datetime.now().strftime(TIMESTAMP_FORMAT)
+    session_id = session_id or "unknown"
 
+    try:
+        get_chat_log_writer().write([
+            make_event(session_id, "user", user_message, now, category),
+            make_event(session_id, "assistant", assistant_message, now),
+        ])
+        print(f"Chat history logged for session {session_id}" + (f" ({category})" if category else ""))
+        return True
 
     except Exception as e:
-        st.error(f"Error saving chat history: {e}")
+        print(f"Error saving chat history: {e}")
+        return False
 
 def classify_message(chat_history: str, current_message: str, model: genai.GenerativeModel) -> str:
     """Classifies the current message as 'normalchat' or 'feedback' using Gemini."""
@@ -169,7 +179,7 @@ def classify_message(chat_history: str, current_message: str, model: genai.Gener
             return "normalchat" # return default classification if not clear
     
     except Exception as e:
-        st.error(f"Error classifying message: {e}")
+        print(f"Error classifying message: {e}")
         return "normalchat" # default case if it errors out
 
 # ---------- File Loading Functions ----------
@@ -182,176 +192,105 @@ def load_feedback_data(file_path: str) -> List[str]:
     except FileNotFoundError:
         st.error(f"File not found: {file_path}")
         return []
-    
-# Function to load files within the selected date range
-def load_files_in_date_range(start_date, end_date):
-    data_dir = "data"
-    chat_history_dir = "data/chatHistory"
-    feedback_files = []
-    
-    if os.path.exists(chat_history_dir):
-      for filename in os.listdir(chat_history_dir):
-          if filename.endswith(".txt"):
-              try:
-                  file_date = date.fromisoformat(filename.replace(".txt", ""))  # assumes file format YYYY-MM-DD
-                  if start_date <= file_date <= end_date:
-                      feedback_files.append(f"chatHistory/{filename}")
-              except ValueError:
-                  continue  # skip if filename doesn't match date format
-
-    return feedback_files
 
 # ---------- Feedback Analysis Functions ----------
 
-def analyze_sentiment(text):
-    """Analyzes the sentiment of the given text and returns a sentiment label."""
-    analysis = TextBlob(text)
-    if analysis.sentiment.polarity > 0.1:
-        return "positive"
-    elif analysis.sentiment.polarity < -0.1:
-        return "negative"
-    else:
-        return "neutral"
-
-def categorize_feedback_batch(texts, model):
-  """Categorizes a list of feedback texts using Gemini API."""
-  
-  combined_texts = "\n".join([f"- {text}" for text in texts]) # Format a string for the prompt, each item on a new line
-  classification_prompt = f"""You are a classification tool designed to categorize user feedback about government schemes into a category.
+# Bump these when the sentiment scorer or the categorization prompt changes, so cached labels are redone
+SENTIMENT_VERSION = "lexicon-0.2"
+CATEGORY_PROMPT_VERSION = "categorize-v2"
+
+def enrichment_versions() -> dict:
+    """Returns the model and scorer and prompt versions feedback is processed with, for run metadata."""
+    return {
+        "model": model.model_name,
+        "sentiment_version": SENTIMENT_VERSION,
+        "category_version": CATEGORY_PROMPT_VERSION,
+        "summary_version": SUMMARY_PROMPT_VERSION,
+    }
 
-        Instructions:
-        1. Analyze each user's feedback text below, and decide on a category for each of the user's feedback.
-        2. The categories are as follows:
-            "Scheme Specific Feedback"
-            "General Feedback"
-            "Chatbot Feedback"
-        3. Return the category that best fits each of the user's feedback.
-        4. The category of each feedback MUST be on a new line. Do not include any other text, only the category.
-        4. The lines MUST match the same ordering as the feedback given below.
-
-        User's feedback:
-        {combined_texts}
-        """
-  try:
-      chat_session = model.start_chat(history=[])
-      response = chat_session.send_message(classification_prompt)
-      cleaned_response = response.text.strip()
-      
-      results = []
-      for line in cleaned_response.splitlines():
-        results.append(line.strip())
-      return results
-  except Exception as e:
-      print(f"Error classifying message: {e}")
-      return ["Uncategorized"] * len(texts)
-
-def process_feedback(file_path, batch_size, model):
-  """Processes the pure feedback file, adds sentiment labels and categories in batches."""
-  feedback_entries = []
-  try:
-      with open(file_path, 'r', encoding='utf-8') as f:
-          batch = []
-          for line in f:
-            line = line.strip()
-            if line: # Ensure the line is not empty
-                parts = line.split("\t")
-                if len(parts) == 2:  # Check if it is in the correct format.
-                  text, timestamp = parts
-                  batch.append((text, timestamp))
-                  if len(batch) == batch_size:
-                    texts, timestamps = zip(*batch)
-                    sentiments = [analyze_sentiment(text) for text in texts]
-                    categories= categorize_feedback_batch(texts, model)
-                    for i, (text, timestamp) in enumerate(batch):
-                       feedback_entries.append({
-                            "text": text,
-                            "timestamp": timestamp,
-                            "sentiment": sentiments[i],
-                            "category": categories[i],
-                        })
-                    batch = [] # reset the batch
-          # Process any remaining items
-          if batch:
-            texts, timestamps = zip(*batch)
-            sentiments = [analyze_sentiment(text) for text in texts]
-            categories = categorize_feedback_batch(texts, model)
-            for i, (text, timestamp) in enumerate(batch):
-                feedback_entries.append({
-                    "text": text,
-                    "timestamp": timestamp,
-                    "sentiment": sentiments[i],
-                    "category": categories[i],
-                })
-  except FileNotFoundError:
-    print(f"Error: File not found at {file_path}")
-    return []
-  return feedback_entries
-
-def get_all_feedback_data(start_date, end_date):
+# Sentiment and category of every feedback entry processed so far
+enrichment_cache = EnrichmentCache()
+
+def process_feedback(entries, batch_size, model, on_progress=None):
+  """Adds sentiment labels and categories to a list of (text, timestamp) feedback entries.
+
+  Labels already in the enrichment cache at the current scorer and prompt versions are reused,
+  so only new entries are scored and sent to Gemini for categorization. batch_size is the
+  starting categorization batch size, the scheduler adapts it from there. on_progress(done, total)
+  is called with the number of entries done after the cache lookup and each batch, entries left
+  Uncategorized counting as done, so it reaches the total when categorization ends.
+  """
+  category_version = f"{model.model_name}:{CATEGORY_PROMPT_VERSION}"
+  cached = enrichment_cache.get_many(entries, SENTIMENT_VERSION, category_version)
+
+  missing_sentiment = [i for i, labels in enumerate(cached) if labels["sentiment"] is None]
+  if missing_sentiment:
+      sentiments = get_sentiment_scorer().labels([entries[i][0] for i in missing_sentiment])
+      for i, sentiment in zip(missing_sentiment, sentiments):
+          cached[i]["sentiment"] = sentiment
+      enrichment_cache.put_sentiments([entries[i] for i in missing_sentiment], sentiments, SENTIMENT_VERSION)
+
+  missing_category = [i for i, labels in enumerate(cached) if labels["category"] is None]
+  done = len(entries) - len(missing_category)
+  if on_progress:
+      on_progress(done, len(entries))
+  if missing_category:
+      def store_batch(indices, categories):
+          nonlocal done
+          # Failed or unexpected categories, Uncategorized included, are not cached, so they are retried next time
+          valid = [(missing_category[i], category) for i, category in zip(indices, categories) if category in FEEDBACK_CATEGORIES]
+          enrichment_cache.put_categories([entries[i] for i, _ in valid], [category for _, category in valid], category_version)
+          done += len(indices)
+          if on_progress:
+              on_progress(done, len(entries))
+
+      scheduler = CategorizationScheduler(model, generation_config["max_output_tokens"], initial_batch_size=batch_size)
+      categories = scheduler.categorize([entries[i][0] for i in missing_category], on_batch=store_batch)
+      for i, category in zip(missing_category, categories):
+          cached[i]["category"] = category
+      print(f"Categorization: {scheduler.summary()}")
+
+  print(f"Enriched {len(entries)} feedback entries: {len(missing_sentiment)} scored, {len(missing_category)} categorized, the rest cached")
+  return [
+      {"text": text, "timestamp": timestamp, "sentiment": labels["sentiment"], "category": labels["category"]}
+      for (text, timestamp), labels in zip(entries, cached)
+  ]
+
+def get_all_feedback_data(start_date, end_date, on_progress=None):
   """Loads and filters all the feedback data between the start and end dates"""
-  data_dir = "data/chatHistory/purefeedback"
-  feedback_files = []
-  
-  if os.path.exists(data_dir):
-      for filename in os.listdir(data_dir):
-          if filename.startswith("purefeedback_") and filename.endswith(".txt"):
-              try:
-                file_date_str = filename.replace("purefeedback_", "").replace(".txt", "")
-                file_date = date.fromisoformat(file_date_str) # assumes file format YYYY-MM-DD
-                if start_date <= file_date <= end_date:
-                    feedback_files.append(os.path.join(data_dir, filename))
-              except ValueError:
-                  continue
-  all_feedback = []
-  for feedback_file in feedback_files:
-      feedback_batch = process_feedback(feedback_file, 10, model)
-      all_feedback.extend(feedback_batch)
-  return pd.DataFrame(all_feedback)
-
-def process_data(df):
-    """Processes all the data for the dashboard."""
-    # Metrics
-    overall_sentiment = df['sentiment'].apply(lambda x: 1 if x == "positive" else -1 if x =="negative" else 0).mean()
-    total_feedback = len(df)
-
-    #Feedback Counts
-    positive_feedback = len(df[df['sentiment'] == "positive"])
-    negative_feedback = len(df[df['sentiment'] == "negative"])
-
-     # Category Counts
-    category_counts = df['category'].value_counts().to_dict()
-
-    #Feedback Ratio
-    sentiment_counts = df['sentiment'].value_counts(normalize=True) * 100
+  entries = [(event["message"], event["timestamp"]) for event in read_feedback(start_date, end_date)]
+  return pd.DataFrame(process_feedback(entries, 10, model, on_progress))
+
+def process_rollup(rollup):
+    """Computes the dashboard metrics, category counts, sentiment shares and daily series from daily rollup rows."""
+    total_feedback = int(rollup['count'].sum())
+    sentiment_totals = rollup.groupby('sentiment')['count'].sum()
+    positive_feedback = int(sentiment_totals.get('positive', 0))
+    negative_feedback = int(sentiment_totals.get('negative', 0))
+    overall_sentiment = (positive_feedback - negative_feedback) / total_feedback if total_feedback else float('nan')
+
+    category_counts = rollup.groupby('category')['count'].sum().sort_values(ascending=False).to_dict()
+
     segments = {
-        'Positive': sentiment_counts.get('positive', 0),
-        'Neutral': sentiment_counts.get('neutral', 0),
-        'Negative': sentiment_counts.get('negative', 0)
+        'Positive': positive_feedback / total_feedback * 100 if total_feedback else 0,
+        'Neutral': sentiment_totals.get('neutral', 0) / total_feedback * 100 if total_feedback else 0,
+        'Negative': negative_feedback / total_feedback * 100 if total_feedback else 0
     }
 
-    #Time Series
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['date'] = df['timestamp'].dt.date
-    df_daily = df.groupby('date').count().reset_index()
-    df_daily.rename(columns={"text":"Feedback Count"}, inplace=True) #rename for plotting later
+    # Time Series, with each day's average polarity alongside its count
+    df_daily = rollup.groupby('date')[['count', 'polarity_sum']].sum().reset_index()
+    df_daily['Average Polarity'] = df_daily['polarity_sum'] / df_daily['count']
+    df_daily.rename(columns={"count":"Feedback Count"}, inplace=True)
     df_daily['Date'] = pd.to_datetime(df_daily['date'])
     return overall_sentiment, total_feedback, positive_feedback, negative_feedback, category_counts, segments, df_daily
 
 def summarize_feedback(df):
-    combined_texts = "\n".join([f"- {text}" for text in df['text']])
-    classification_prompt = f"""You are a helpful assistant that summarizes feedback for users.
-         Instructions:
-          1. Use the feedback from the users below to create a useful summarisation of feedback about government schemes.
-          2. Provide an overall summary of the general feedback, as well as specific points about the different types of feedback.
-
-        User Feedback:
-          {combined_texts}
-         """
+    """Summarizes the feedback in df by map-reduce over its days and categories, reusing cached partial summaries."""
     try:
-        chat_session = model.start_chat(history=[])
-        response = chat_session.send_message(classification_prompt)
-        cleaned_response = response.text.strip()
-        return cleaned_response
+        summarizer = FeedbackSummarizer(model)
+        summary = summarizer.summarize(df)
+        print(f"Summarization: {summarizer.stats}")
+        return summary
     except Exception as e:
         print(f"Error summarizing feedback: {e}")
-        return "No summary available"
\ No newline at end of file
+        return "No summary available"
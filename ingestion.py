@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+from langchain_community.document_loaders import PyPDFLoader
+from functions import create_embeddings, chunk_text, clean_text, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL
+from rate_limit import call_with_backoff
+
+
+# Ingestion settings, tune these against the throughput reported at the end of a run
+EMBED_BATCH_SIZE = 100  # texts per embedding request (the Gemini API limit)
+MAX_WORKERS = 4  # concurrent embedding requests
+WRITE_BATCH_SIZE = 1000  # chunks per ChromaDB upsert call
+
+# Manifest of what is currently indexed, stored next to the chroma_db folder
+MANIFEST_PATH = "chroma_manifest.json"
+
+# ---------- Manifest Functions ----------
+
+def index_settings() -> Dict:
+    """Returns the settings that, when changed, invalidate every indexed chunk."""
+    return {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": EMBEDDING_MODEL,
+    }
+
+def empty_manifest() -> Dict:
+    return {"settings": index_settings(), "index_version": None, "documents": {}}
+
+def load_manifest(path: str = MANIFEST_PATH) -> Dict:
+    """Loads the index manifest, starting a fresh one if it is missing or was built with other settings."""
+    if not os.path.exists(path):
+        return empty_manifest()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading manifest {path}, rebuilding index: {e}")
+        return empty_manifest()
+    if manifest.get("settings") != index_settings():
+        print("Chunker or embedding settings changed, rebuilding index...")
+        return empty_manifest()
+    return manifest
+
+def save_manifest(manifest: Dict, path: str = MANIFEST_PATH):
+    """Writes the manifest atomically so an interrupted run never leaves it half written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def file_hash(path: str) -> str:
+    """Returns the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_hash(text: str) -> str:
+    """Returns the SHA-256 of a chunk's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def remove_stale_chunks(collection, manifest: Dict) -> int:
+    """Deletes chunks from the collection that the manifest no longer lists (deleted, shrunk or failed documents)."""
+    valid_ids = set()
+    for document in manifest["documents"].values():
+        valid_ids.update(document["chunks"].keys())
+    stale_ids = [chunk_id for chunk_id in collection.get(include=[])["ids"] if chunk_id not in valid_ids]
+    for start in range(0, len(stale_ids), WRITE_BATCH_SIZE):
+        collection.delete(ids=stale_ids[start:start + WRITE_BATCH_SIZE])
+    return len(stale_ids)
+
+# ---------- Document Loading Functions ----------
+
+def load_document_chunks(pdf_path: str, filename: str) -> List[Dict]:
+    """Loads a PDF and splits every page into chunks with their ChromaDB ids and metadata."""
+    loader = PyPDFLoader(pdf_path)
+    pdf_document = loader.load()
+
+    chunks = []
+    for i, page in enumerate(pdf_document):
+        cleaned_content = clean_text(page.page_content)
+        for j, chunk in enumerate(chunk_text(cleaned_content)):
+            chunks.append({
+                "id": f"{filename}_page_{i}_chunk_{j}",
+                "document": chunk,
+                "metadata": {"source": filename, "page": i, "chunk": j},
+            })
+    return chunks
+
+# ---------- Embedding and Indexing Functions ----------
+
+def embed_batch(texts: List[str]) -> List[List[float]]:
+    """Embeds one batch of texts, backing off when the API is rate limited."""
+    return call_with_backoff(create_embeddings, texts)
+
+def write_chunks(collection, chunks: List[Dict], embeddings: List[List[float]]):
+    """Writes chunks and their embeddings to the collection in bulk upsert calls."""
+    for start in range(0, len(chunks), WRITE_BATCH_SIZE):
+        batch = chunks[start:start + WRITE_BATCH_SIZE]
+        collection.upsert(
+            ids=[chunk["id"] for chunk in batch],
+            documents=[chunk["document"] for chunk in batch],
+            metadatas=[chunk["metadata"] for chunk in batch],
+            embeddings=embeddings[start:start + WRITE_BATCH_SIZE],
+        )
+
+def index_chunks(collection, chunks: List[Dict], batch_size: int = EMBED_BATCH_SIZE, max_workers: int = MAX_WORKERS) -> Dict:
+    """Embeds chunks in concurrent batches and upserts them into the collection, returning run statistics."""
+    start_time = time.perf_counter()
+    batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+    indexed = 0
+    failed_ids = set()
+
+    pending_chunks = []
+    pending_embeddings = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(embed_batch, [chunk["document"] for chunk in batch]): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                print(f"Error embedding batch starting at {batch[0]['id']}: {e}")
+                failed_ids.update(chunk["id"] for chunk in batch)
+                continue
+
+            # ChromaDB writes stay on this thread, only the API calls run concurrently
+            pending_chunks.extend(batch)
+            pending_embeddings.extend(embeddings)
+            if len(pending_chunks) >= WRITE_BATCH_SIZE:
+                write_chunks(collection, pending_chunks, pending_embeddings)
+                indexed += len(pending_chunks)
+                pending_chunks, pending_embeddings = [], []
+
+    if pending_chunks:
+        write_chunks(collection, pending_chunks, pending_embeddings)
+        indexed += len(pending_chunks)
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        "indexed": indexed,
+        "failed": len(failed_ids),
+        "failed_ids": failed_ids,
+        "seconds": elapsed,
+        "chunks_per_second": indexed / elapsed if elapsed > 0 else 0.0,
+    }
+
+def sync_documents(collection, documents_folder: str, manifest: Dict) -> Dict:
+    """Brings the collection in line with the PDFs in documents_folder, embedding only new or changed chunks."""
+    changed = False
+    to_index = []
+    new_entries = {}
+
+    filenames = sorted(f for f in os.listdir(documents_folder) if f.lower().endswith(".pdf"))
+    for filename in filenames:
+        pdf_path = os.path.join(documents_folder, filename)
+        current_hash = file_hash(pdf_path)
+        previous = manifest["documents"].get(filename)
+        if previous and previous["file_hash"] == current_hash:
+            print(f"Unchanged: {filename}")
+            continue
+
+        print(f"Processing: {filename}...")
+        try:
+            chunks = load_document_chunks(pdf_path, filename)
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+            continue
+
+        previous_chunks = previous["chunks"] if previous else {}
+        chunk_hashes = {chunk["id"]: chunk_hash(chunk["document"]) for chunk in chunks}
+        modified = [chunk for chunk in chunks if previous_chunks.get(chunk["id"]) != chunk_hashes[chunk["id"]]]
+        to_index.extend(modified)
+        new_entries[filename] = {"file_hash": current_hash, "chunks": chunk_hashes}
+        print(f"Finished processing: {filename} ({len(modified)} of {len(chunks)} chunks new or changed)")
+
+    stats = index_chunks(collection, to_index)
+
+    # Only record chunks that made it into the collection, failed ones are retried on the next run
+    for filename, entry in new_entries.items():
+        failed = [chunk_id for chunk_id in entry["chunks"] if chunk_id in stats["failed_ids"]]
+        if failed:
+            for chunk_id in failed:
+                del entry["chunks"][chunk_id]
+            entry["file_hash"] = None  # forces the document to be re-checked on the next run
+        manifest["documents"][filename] = entry
+        changed = True
+
+    for filename in list(manifest["documents"]):
+        if filename not in filenames:
+            print(f"Removed: {filename}")
+            del manifest["documents"][filename]
+            changed = True
+
+    stats["removed"] = remove_stale_chunks(collection, manifest)
+    if changed or stats["removed"]:
+        manifest["index_version"] = datetime.now().isoformat(timespec="seconds")
+    return stats
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from typing import Dict
+from functions import classify_message, save_chat_history
+from chat_log import get_writer as get_chat_log_writer
+
+
+MAX_QUEUE_SIZE = 100
+NUM_WORKERS = 1  # a single worker keeps turns in the chat log in the order they happened
+SAVE_RETRIES = 3
+DRAIN_TIMEOUT = 30  # seconds to wait for queued turns on shutdown
+
+# Turns that could not be saved after every retry are kept here instead of being lost
+UNSAVED_TURNS_PATH = "data/chatHistory/unsaved_turns.jsonl"
+
+
+def process_turn(turn: Dict):
+    """Classifies a finished chat turn and saves it to the chat log."""
+    classification = classify_message(turn["chat_history"], turn["user_message"], turn["model"])
+    for attempt in range(SAVE_RETRIES):
+        if save_chat_history(
+            turn["user_message"],
+            turn["assistant_message"],
+            category=classification,
+            session_id=turn.get("session_id"),
+        ):
+            return
+        time.sleep(2 ** attempt)
+    save_unsaved_turn(turn, classification)
+
+def save_unsaved_turn(turn: Dict, classification: str = None):
+    """Appends a turn that could not be saved normally to the unsaved turns file."""
+    record = {key: value for key, value in turn.items() if key != "model"}
+    record["category"] = classification
+    record["failed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    os.makedirs(os.path.dirname(UNSAVED_TURNS_PATH), exist_ok=True)
+    with open(UNSAVED_TURNS_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Chat turn could not be saved, kept in {UNSAVED_TURNS_PATH}")
+
+
+class PostProcessingWorker:
+    """Queue-backed background workers that run turn post-processing off the response path."""
+
+    def __init__(self, max_queue_size: int = MAX_QUEUE_SIZE, num_workers: int = NUM_WORKERS):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.threads = []
+        for i in range(num_workers):
+            # Daemon threads so a stuck API call can never block interpreter exit, drain() waits for queued work
+            thread = threading.Thread(target=self._run, name=f"postprocessing-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        atexit.register(self.drain)
+
+    def _run(self):
+        while True:
+            turn = self.queue.get()
+            try:
+                if turn is None:
+                    return
+                process_turn(turn)
+            except Exception as e:
+                print(f"Error post-processing chat turn: {e}")
+                try:
+                    save_unsaved_turn(turn)
+                except Exception as save_error:
+                    print(f"Error keeping unsaved chat turn: {save_error}")
+            finally:
+                self.queue.task_done()
+
+    def submit(self, turn: Dict):
+        """Queues a turn for post-processing, processing it inline if the queue is full rather than dropping it."""
+        try:
+            self.queue.put_nowait(turn)
+        except queue.Full:
+            print("Post-processing queue is full, processing chat turn inline")
+            process_turn(turn)
+
+    def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """Stops the workers once every queued turn has been processed, or the timeout has passed."""
+        deadline = time.monotonic() + timeout
+        for _ in self.threads:
+            try:
+                self.queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self.threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+        # Anything still queued after the timeout is written out rather than lost
+        while True:
+            try:
+                turn = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if turn is not None:
+                save_unsaved_turn(turn)
+        # The chat log writer may have closed already, so write out what the workers logged during the drain
+        get_chat_log_writer().flush(sync=True)
+
+
+# One worker shared by every session in this process
+worker = PostProcessingWorker()
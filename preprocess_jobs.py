@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import date
+from typing import Callable, Dict, List
+from functions import get_all_feedback_data, summarize_feedback, enrichment_versions
+from feedback_store import run_label, write_feedback, record_run, feedback_counts
+
+
+JOBS_PATH = "data/cache/jobs.sqlite3"
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def run_preprocessing(start_date: date, end_date: date, on_progress: Callable[[str, int, int], None]) -> int:
+    """Enriches, summarizes and stores the feedback of a date range, returning the number of entries.
+
+    Categorized batches are checkpointed in the enrichment cache and partial summaries in the
+    summary cache as they complete, so running a range again after an interruption only pays for
+    the work that had not finished.
+    """
+    df = get_all_feedback_data(start_date, end_date, on_progress=lambda done, total: on_progress("categorizing", done, total))
+    if df.empty:
+        return 0
+    on_progress("summarizing", len(df), len(df))
+    ai_summary = summarize_feedback(df)
+    on_progress("saving", len(df), len(df))
+    write_feedback(df, start_date, end_date)
+    record_run(start_date, end_date, ai_summary, {**feedback_counts(df), **enrichment_versions()})
+    return len(df)
+
+
+class JobTable:
+    """SQLite table of preprocessing jobs: their date range, status, stage and progress."""
+
+    def __init__(self, path: str = JOBS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, label TEXT NOT NULL, start_date TEXT NOT NULL, end_date TEXT NOT NULL, "
+                "status TEXT NOT NULL, stage TEXT, done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, "
+                "done_at_start INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, updated_at REAL, finished_at REAL)"
+            )
+        return self._conn
+
+    def enqueue(self, start_date: date, end_date: date) -> int:
+        """Queues a range, returning the id of its job, or of the queued or running job it already has."""
+        label = run_label(start_date, end_date)
+        with self.lock:
+            conn = self._connection()
+            row = conn.execute(
+                f"SELECT id FROM jobs WHERE label = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})", (label, *ACTIVE_STATUSES)
+            ).fetchone()
+            if row:
+                return row["id"]
+            cursor = conn.execute(
+                "INSERT INTO jobs (label, start_date, end_date, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (label, start_date.isoformat(), end_date.isoformat(), time.time()),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def claim_next(self) -> Dict:
+        """Marks the oldest queued job as running and returns it, or None if nothing is queued."""
+        with self.lock:
+            conn = self._connection()
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'starting', attempts = attempts + 1, error = NULL, "
+                "done = 0, done_at_start = 0, started_at = ?, updated_at = ? WHERE id = ?",
+                (now, now, row["id"]),
+            )
+            conn.commit()
+            return dict(row)
+
+    def update(self, job_id: int, **fields):
+        fields["updated_at"] = time.time()
+        with self.lock:
+            conn = self._connection()
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def requeue_interrupted(self) -> int:
+        """Queues again the jobs left running by a process that stopped, returning how many there were."""
+        with self.lock:
+            conn = self._connection()
+            cursor = conn.execute("UPDATE jobs SET status = 'queued', stage = 'interrupted' WHERE status = 'running'")
+            conn.commit()
+            return cursor.rowcount
+
+    def jobs(self, limit: int = 20) -> List[Dict]:
+        """Returns the most recent jobs, newest first."""
+        with self.lock:
+            rows = self._connection().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def active_labels(self) -> List[str]:
+        with self.lock:
+            rows = self._connection().execute(
+                f"SELECT label FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))})", ACTIVE_STATUSES
+            ).fetchall()
+        return [row["label"] for row in rows]
+
+
+class JobRunner:
+    """Background worker that runs queued preprocessing jobs one at a time.
+
+    One job runs at a time, since every job shares the Gemini rate limit anyway. Jobs that were
+    running when the process stopped are queued again on start, and resume from the caches.
+    """
+
+    def __init__(self, table: JobTable = None):
+        self.table = table or JobTable()
+        interrupted = self.table.requeue_interrupted()
+        if interrupted:
+            print(f"Resuming {interrupted} interrupted preprocessing job(s)")
+        self.wake = threading.Event()
+        # Daemon thread so a stuck API call never blocks interpreter exit, interrupted jobs resume on the next start
+        self.thread = threading.Thread(target=self._run, name="preprocess-jobs", daemon=True)
+        self.thread.start()
+
+    def submit(self, start_date: date, end_date: date) -> int:
+        """Queues a date range for preprocessing and returns its job id without waiting for it."""
+        job_id = self.table.enqueue(start_date, end_date)
+        self.wake.set()
+        return job_id
+
+    def _run(self):
+        while True:
+            job = self.table.claim_next()
+            if job is None:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            self._process(job)
+
+    def _process(self, job: Dict):
+        job_id = job["id"]
+        first_progress = True
+
+        def on_progress(stage: str, done: int, total: int):
+            nonlocal first_progress
+            fields = {"stage": stage, "done": done, "total": total}
+            if first_progress:
+                # Entries already labelled in the cache, so throughput only counts work done by this attempt
+                fields["done_at_start"] = done
+                first_progress = False
+            self.table.update(job_id, **fields)
+
+        try:
+            count = run_preprocessing(date.fromisoformat(job["start_date"]), date.fromisoformat(job["end_date"]), on_progress)
+            self.table.update(job_id, status="done", stage="done" if count else "no feedback", finished_at=time.time())
+            print(f"Preprocessed {count} feedback entries for {job['label']}")
+        except Exception as e:
+            print(f"Error preprocessing {job['label']}: {e}")
+            self.table.update(job_id, status="failed", error=str(e), finished_at=time.time())
+
+
+def job_throughput(job: Dict) -> float:
+    """Returns the entries per second a job has labelled since it (last) started."""
+    elapsed = (job["updated_at"] or 0) - (job["started_at"] or 0)
+    return (job["done"] - job["done_at_start"]) / elapsed if elapsed > 0 else 0.0
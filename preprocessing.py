@@ -3,9 +3,9 @@ import google.generativeai as genai
 import chromadb
 from typing import List
 from dotenv import load_dotenv
-from functions import create_embedding, chunk_text, clean_text
-import re
-from langchain_community.document_loaders import PyPDFLoader
+from functions import create_embedding, embedding_cache
+from ingestion import load_manifest, save_manifest, sync_documents
+from bm25_index import BM25Index, BM25_INDEX_PATH, build_index_from_collection, hybrid_query
 
 # Load environment variables
 load_dotenv(dotenv_path="config/.env")
@@ -24,28 +24,18 @@ collection = client.get_or_create_collection(name=collection_name)
 documents_folder = "data/documents"
 
 print("Processing PDF documents...")
-for filename in os.listdir(documents_folder):
-    if filename.lower().endswith(".pdf"):
-        pdf_path = os.path.join(documents_folder, filename)
-        print(f"Processing: {filename}...")
-        try:
-            loader = PyPDFLoader(pdf_path)
-            pdf_document = loader.load()
+manifest = load_manifest()
+stats = sync_documents(collection, documents_folder, manifest)
+save_manifest(manifest)
+print(f"Indexed {stats['indexed']} chunks in {stats['seconds']:.1f}s ({stats['chunks_per_second']:.1f} chunks/s), removed {stats['removed']} stale chunks")
+if stats['failed']:
+    print(f"Warning: {stats['failed']} chunks failed to embed, re-run preprocessing to retry them")
 
-            for i, page in enumerate(pdf_document):
-                cleaned_content = clean_text(page.page_content)
-                chunks = chunk_text(cleaned_content)
-                for j, chunk in enumerate(chunks):
-                    embedding = create_embedding(chunk)
-                    collection.add(
-                        embeddings=[embedding],
-                        documents=[chunk],
-                        ids=[f"{filename}_page_{i}_chunk_{j}"],
-                        metadatas=[{"source": filename, "page": i}]
-                    )
-            print(f"Finished processing: {filename}")
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+# Rebuild the BM25 index whenever the collection changed
+if stats['indexed'] or stats['removed'] or not os.path.exists(BM25_INDEX_PATH):
+    print("\nBuilding BM25 index...")
+    bm25_stats = build_index_from_collection(collection)
+    print(f"Indexed {bm25_stats['documents']} chunks ({bm25_stats['terms']} terms) in {bm25_stats['seconds']:.2f}s")
 
 # Test queries for budget documents
 test_queries = [
@@ -55,6 +45,7 @@ test_queries = [
 
 
 print("\nTesting queries...")
+bm25_index = BM25Index.load()
 for query in test_queries:
     print(f"\nQuery: {query}")
     query_embedding = create_embedding(query)
@@ -72,4 +63,13 @@ for query in test_queries:
         print(f"Similarity Score: {similarity:.2f}")
         print(f"Source: {metadata['source']}, Page: {metadata['page']}")
 
+    # Compare with hybrid retrieval and report its latency
+    hybrid_results = hybrid_query(collection, bm25_index, query, query_embedding, n_results=5)
+    print(f"\nHybrid top 5 (vector {hybrid_results['timings']['vector_seconds'] * 1000:.0f} ms, BM25 {hybrid_results['timings']['lexical_seconds'] * 1000:.1f} ms):")
+    for metadata in hybrid_results['metadatas'][0]:
+        print(f"Source: {metadata['source']}, Page: {metadata['page']}")
+
+cache_stats = embedding_cache.stats()
+print(f"\nEmbedding cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+
 print("\nTest completed!")
\ No newline at end of file
@@ -0,0 +1,60 @@
+import random
+import time
+import threading
+from google.api_core import exceptions as google_exceptions
+
+
+# Errors from the Gemini API that are worth retrying (rate limits and transient server errors)
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+MAX_RETRIES = 5
+BASE_DELAY = 1.0  # seconds
+MAX_DELAY = 60.0  # seconds
+
+
+def backoff_delay(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY) -> float:
+    """Returns an exponential backoff delay with full jitter for the given attempt number."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_backoff(func, *args, max_retries: int = MAX_RETRIES, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY, **kwargs):
+    """Calls func, retrying rate-limit and transient API errors with jittered exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Retryable API error ({type(e).__name__}), retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that limits how often API requests are started."""
+
+    def __init__(self, requests_per_minute: float, capacity: float = None):
+        self.rate = requests_per_minute / 60.0  # tokens added per second
+        self.capacity = capacity if capacity is not None else max(1.0, requests_per_minute / 6)  # bursts of up to 10 seconds' worth
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """Blocks until the requested tokens are available, then takes them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
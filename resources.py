@@ -0,0 +1,77 @@
+import os
+import time
+import streamlit as st
+import chromadb
+import google.generativeai as genai
+from dotenv import load_dotenv
+from bm25_index import BM25Index, BM25_INDEX_PATH
+
+
+CHROMA_PATH = "chroma_db"
+COLLECTION_NAME = "budgetinfo"
+MODEL_NAME = "gemini-2.0-flash-exp"
+
+# The functions below are cached with st.cache_resource, so each resource is created once per
+# process and shared by app.py, feedback.py and dashboard.py across reruns and sessions.
+
+@st.cache_resource
+def configure_gemini() -> bool:
+    """Loads the API key from config/.env and configures the Gemini client."""
+    load_dotenv(dotenv_path="config/.env")
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return True
+
+@st.cache_resource
+def get_generative_model(generation_config: dict, model_name: str = MODEL_NAME, system_instruction: str = None) -> genai.GenerativeModel:
+    """Returns a shared Gemini model for the given generation config and system instruction."""
+    configure_gemini()
+    return genai.GenerativeModel(model_name=model_name, generation_config=generation_config, system_instruction=system_instruction)
+
+@st.cache_resource
+def get_chroma_client():
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+def current_index_version():
+    """Returns the index version preprocessing.py recorded in the manifest, which changes on every re-index."""
+    from answer_cache import current_index_version  # imported here, see get_answer_cache
+    return current_index_version()
+
+def get_collection(name: str = COLLECTION_NAME):
+    """Returns the collection opened for the current index version, reopened after preprocessing.py re-indexes it."""
+    return _open_collection(name, current_index_version())
+
+def get_bm25_index():
+    """Returns the BM25 index built for the current index version, or None if it has not been built."""
+    # The file time also catches an index built for a collection that did not change
+    built_at = os.path.getmtime(BM25_INDEX_PATH) if os.path.exists(BM25_INDEX_PATH) else None
+    return _load_bm25_index(current_index_version(), built_at)
+
+# The index version is only a cache key: a new version opens the collection and loads the BM25
+# index again, and max_entries=1 drops the ones opened for the previous version.
+
+@st.cache_resource(max_entries=1)
+def _open_collection(name: str, index_version: str):
+    """Opens the collection and warms its HNSW index with one query, so the first user question does not pay for loading it."""
+    start_time = time.perf_counter()
+    collection = get_chroma_client().get_collection(name)
+    sample = collection.peek(limit=1)
+    if len(sample["ids"]):
+        collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1, include=[])
+    print(f"Opened and warmed collection {name} (index version {index_version}) in {time.perf_counter() - start_time:.2f}s")
+    return collection
+
+@st.cache_resource(max_entries=1)
+def _load_bm25_index(index_version: str, built_at: float):
+    if built_at is None:
+        print(f"No BM25 index at {BM25_INDEX_PATH}, run preprocessing.py to build it")
+        return None
+    start_time = time.perf_counter()
+    index = BM25Index.load()
+    print(f"Loaded BM25 index with {len(index.ids)} chunks (index version {index_version}) in {time.perf_counter() - start_time:.2f}s")
+    return index
+
+@st.cache_resource
+def get_answer_cache():
+    """Returns the answer cache shared by every chatbot session."""
+    from answer_cache import AnswerCache  # imported here, answer_cache imports functions which imports this module
+    return AnswerCache()
@@ -0,0 +1,178 @@
+import re
+import time
+import numpy as np
+from typing import Dict, Iterable, List
+from textblob.en import sentiment as pattern_lexicon
+
+
+SENTIMENT_THRESHOLD = 0.1  # polarity above +0.1 is positive, below -0.1 negative
+
+# Words are lowercased and split like TextBlob's tokenizer does: apostrophes split a word
+# (so "n't" never reaches the negation check there either), hyphens do not
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:-[^\W_]+)*|!")
+NEGATIONS = {"no", "not", "never"}
+NEGATION_FACTOR = -0.5  # "not good" is slightly bad, "not bad" slightly good
+EXCLAMATION_BOOST = 1.25
+
+# Phrasings where the scorer has to follow TextBlob's modifier and negation rules closely,
+# added to the stored feedback in the agreement report
+AGREEMENT_CHECK_TEXTS = [
+    "The app is really not helpful at all",
+    "absolutely not helpful",
+    "really not good",
+    "This is really not fair",
+    "totally not useful",
+    "not really good",
+    "really not very good",
+    "very not a good idea",
+    "The rebates are very good!",
+]
+
+
+class BatchSentimentScorer:
+    """Scores the sentiment of many texts at once with TextBlob's lexicon and NumPy array operations.
+
+    Follows TextBlob's pattern analyzer: polarity is the mean of the lexicon polarities of known
+    words, with a preceding adverb scaling the next word by its intensity ("very good"), a
+    preceding negation (also across one-letter words, "not a good") flipping and halving it, an
+    -ly adverb before a negation being negated with it ("really not good"), and each "!"
+    boosting the last scored word. Modifier chains across unknown words, emoticons and "(!)"
+    irony are not modelled, see the agreement report in __main__.
+    """
+
+    def __init__(self):
+        pattern_lexicon.load()
+        words = sorted(pattern_lexicon.keys())
+        self.vocabulary = {word: i for i, word in enumerate(words)}
+        scores = np.array([pattern_lexicon[word][None] for word in words], dtype=np.float64)
+        self.word_polarity = scores[:, 0]
+        self.word_intensity = scores[:, 2]
+        self.word_is_modifier = np.array([any(pos in pattern_lexicon.modifiers for pos in pattern_lexicon[word]) for word in words])
+        # Only -ly adverbs carry over a negation to the next word ("really not good")
+        self.word_carries_negation = self.word_is_modifier & np.array([pattern_lexicon.modifier(word) for word in words])
+
+    def polarities(self, texts: Iterable[str]) -> np.ndarray:
+        """Returns the polarity, between -1.0 and 1.0, of each text."""
+        texts = list(texts)
+        tokens = []
+        lengths = []
+        for text in texts:
+            found = TOKEN_PATTERN.findall(text.lower())
+            tokens.extend(found)
+            lengths.append(len(found))
+        if not tokens:
+            return np.zeros(len(texts))
+
+        doc = np.repeat(np.arange(len(texts)), lengths)
+        ids = np.fromiter((self.vocabulary.get(token, -1) for token in tokens), dtype=np.int64, count=len(tokens))
+        is_negation = np.fromiter((token in NEGATIONS for token in tokens), dtype=bool, count=len(tokens))
+        is_exclamation = np.fromiter((token == "!" for token in tokens), dtype=bool, count=len(tokens))
+        is_short = np.fromiter((len(token) <= 1 for token in tokens), dtype=bool, count=len(tokens))
+
+        known = ids >= 0
+        safe_ids = np.where(known, ids, 0)
+        polarity = np.where(known, self.word_polarity[safe_ids], 0.0)
+        intensity = np.where(known, self.word_intensity[safe_ids], 1.0)
+        is_modifier = known & self.word_is_modifier[safe_ids]
+        carries_negation = known & self.word_carries_negation[safe_ids]
+
+        def previous(values, fill):
+            return np.concatenate(([fill], values[:-1]))
+
+        def following(values, fill):
+            return np.concatenate((values[1:], [fill]))
+
+        same_doc_as_previous = previous(doc, -1) == doc
+
+        # Negation: the previous token, or the one before it across a one-letter unknown word
+        negated = known & same_doc_as_previous & (
+            previous(is_negation, False)
+            | (previous(previous(is_negation, False), False) & previous(is_short & ~known, False) & previous(same_doc_as_previous, False))
+        )
+
+        # An -ly adverb right before a negation is negated itself ("really not"), and merges into a
+        # known word right after the negation without inverting its intensity ("really not good")
+        negated_modifier = carries_negation & following(is_negation & same_doc_as_previous, False)
+        carried = known & same_doc_as_previous & previous(same_doc_as_previous, False) & previous(previous(negated_modifier, False), False)
+        negated = negated | (negated_modifier & ~following(following(carried, False), False))
+
+        # Modifiers: a known adverb right before a known word merges into it, scaling its polarity
+        merged = known & same_doc_as_previous & previous(is_modifier, False)
+        modifier_intensity = previous(np.where(negated & ~carried, 1.0 / intensity, intensity), 1.0)
+        value = np.where(merged, np.clip(polarity * modifier_intensity, -1.0, 1.0), polarity)
+        value = np.where(carried, np.clip(polarity * previous(previous(intensity, 1.0), 1.0), -1.0, 1.0), value)
+        negated = negated | (merged & previous(negated, False))
+        counted = known & ~following(merged, False) & ~following(following(carried, False), False)
+
+        # Exclamation marks boost the last scored word before them in the same text
+        positions = np.arange(len(tokens))
+        last_counted = np.maximum.accumulate(np.where(counted, positions, -1))
+        targets = previous(last_counted, -1)[is_exclamation]
+        targets = targets[(targets >= 0) & (doc[np.maximum(targets, 0)] == doc[is_exclamation])]
+        boosts = np.bincount(targets, minlength=len(tokens))
+        value = np.clip(value * EXCLAMATION_BOOST ** boosts, -1.0, 1.0)
+
+        value = np.where(negated, value * NEGATION_FACTOR, value)
+        totals = np.bincount(doc, weights=np.where(counted, value, 0.0), minlength=len(texts))
+        counts = np.bincount(doc, weights=counted.astype(np.float64), minlength=len(texts))
+        return totals / np.maximum(counts, 1)
+
+    def labels(self, texts: Iterable[str]) -> List[str]:
+        """Returns "positive", "neutral" or "negative" for each text, split at SENTIMENT_THRESHOLD."""
+        return label_polarities(self.polarities(texts))
+
+
+def label_polarities(polarities: np.ndarray) -> List[str]:
+    return np.select([polarities > SENTIMENT_THRESHOLD, polarities < -SENTIMENT_THRESHOLD], ["positive", "negative"], "neutral").tolist()
+
+
+_scorer = None
+
+def get_scorer() -> BatchSentimentScorer:
+    """Returns the process-wide scorer, loading the lexicon on first use."""
+    global _scorer
+    if _scorer is None:
+        _scorer = BatchSentimentScorer()
+    return _scorer
+
+def agreement_report(texts: List[str], scorer: BatchSentimentScorer = None) -> Dict:
+    """Compares the batch scorer's labels with TextBlob's on the given texts."""
+    from textblob import TextBlob
+
+    scorer = scorer or get_scorer()
+    batch_labels = scorer.labels(texts)
+    textblob_labels = label_polarities(np.array([TextBlob(text).sentiment.polarity for text in texts]))
+    confusion = {}
+    for expected, got in zip(textblob_labels, batch_labels):
+        confusion[(expected, got)] = confusion.get((expected, got), 0) + 1
+    agreed = sum(count for (expected, got), count in confusion.items() if expected == got)
+    return {"texts": len(texts), "agreement": agreed / len(texts) if texts else 1.0, "confusion": confusion}
+
+
+if __name__ == "__main__":
+    # Agreement with TextBlob and throughput on the stored feedback and the policy feedback file
+    from datetime import date
+    from textblob import TextBlob
+    from chat_log import read_events
+
+    texts = [event["message"] for event in read_events(date(2000, 1, 1), date.today(), role="user")]
+    with open("data/policy_feedback.txt", "r", encoding="utf-8") as f:
+        texts += [line.strip() for line in f if line.strip().startswith("Feedback:")]
+    texts += AGREEMENT_CHECK_TEXTS
+
+    scorer = get_scorer()
+    report = agreement_report(texts, scorer)
+    print(f"Agreement with TextBlob on {report['texts']} texts: {report['agreement']:.1%}")
+    for (expected, got), count in sorted(report["confusion"].items()):
+        print(f"  TextBlob {expected:8} batch {got:8} {count}")
+
+    corpus = (texts * (100000 // len(texts) + 1))[:100000]
+    start_time = time.perf_counter()
+    scorer.labels(corpus)
+    batch_seconds = time.perf_counter() - start_time
+    sample = corpus[:5000]
+    start_time = time.perf_counter()
+    for text in sample:
+        TextBlob(text).sentiment.polarity
+    textblob_seconds = (time.perf_counter() - start_time) * len(corpus) / len(sample)
+    print(f"{len(corpus)} texts: batch scorer {len(corpus) / batch_seconds:,.0f} texts/s, TextBlob {len(corpus) / textblob_seconds:,.0f} texts/s (estimated from {len(sample)})")
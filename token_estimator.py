@@ -0,0 +1,77 @@
+import os
+import re
+import json
+import math
+from typing import Dict, List
+
+
+# Calibration of the local estimate against Gemini's count_tokens, written by running this module
+CALIBRATION_PATH = "data/token_calibration.json"
+
+# Used until a calibration has been recorded: no scaling, and no known error bound, the estimate's
+# error against count_tokens is only measured (as max_relative_error) by running this module
+DEFAULT_CALIBRATION = {"scale": 1.0, "samples": 0}
+
+# Words, single digits (Gemini's tokenizer splits numbers into digits) and punctuation marks
+TOKEN_PIECE_PATTERN = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+CHARS_PER_WORD_TOKEN = 6  # long words are split into sub-word tokens of about this many letters
+
+
+def load_calibration(path: str = CALIBRATION_PATH) -> Dict:
+    """Loads the recorded calibration, falling back to the uncalibrated defaults."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict(DEFAULT_CALIBRATION)
+
+calibration = load_calibration()
+
+
+def raw_estimate(text: str) -> int:
+    """Counts sub-word pieces in text before calibration is applied."""
+    pieces = 0
+    for piece in TOKEN_PIECE_PATTERN.findall(text):
+        pieces += math.ceil(len(piece) / CHARS_PER_WORD_TOKEN) if piece[0].isalpha() else 1
+    return pieces
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of Gemini tokens in text locally, without an API call."""
+    if not text:
+        return 0
+    return max(1, round(raw_estimate(text) * calibration["scale"]))
+
+def calibrate(texts: List[str], model) -> Dict:
+    """Fits the estimate's scale to Gemini's exact counts on sample texts and records the worst relative error."""
+    exact = [model.count_tokens(text).total_tokens for text in texts]
+    raw = [raw_estimate(text) for text in texts]
+    scale = sum(exact) / sum(raw)
+    errors = [abs(r * scale - e) / e for r, e in zip(raw, exact) if e]
+    return {"scale": scale, "max_relative_error": max(errors), "samples": len(errors)}
+
+
+if __name__ == "__main__":
+    # Calibrate against Gemini using the chat history and document text already on disk
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+    from langchain_community.document_loaders import PyPDFLoader
+
+    load_dotenv(dotenv_path="config/.env")
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    model = genai.GenerativeModel(model_name="gemini-2.0-flash-exp")
+
+    samples = []
+    for root, _, files in os.walk("data/chatHistory"):
+        for filename in files:
+            if filename.endswith(".txt"):
+                with open(os.path.join(root, filename), "r", encoding="utf-8") as f:
+                    samples.extend(block for block in f.read().split("\n\n") if block.strip())
+    for filename in sorted(os.listdir("data/documents"))[:5]:
+        pages = PyPDFLoader(os.path.join("data/documents", filename)).load()
+        samples.extend(page.page_content for page in pages[:10] if page.page_content.strip())
+
+    result = calibrate(samples, model)
+    os.makedirs(os.path.dirname(CALIBRATION_PATH), exist_ok=True)
+    with open(CALIBRATION_PATH, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Calibrated on {result['samples']} samples: scale {result['scale']:.3f}, max relative error {result['max_relative_error']:.1%}")